@@ -0,0 +1,243 @@
+import threading
+import time
+import numpy as np
+
+#%% Frame ring buffer
+
+class FrameRing:
+
+    # size preallocated uint8 frames (4, buf_len). The slot of the frame being
+    # written is never handed out, so size - 1 frames are readable. Frames
+    # are returned as views, valid(seq) tells if a view is still intact.
+
+    def __init__(self, size, buf_len):
+
+        self.size = size
+
+        self.frames = np.zeros((size, 4, buf_len), dtype = np.uint8)
+        self.times = np.zeros(size)
+        self.trig_words = np.zeros(size, dtype = np.uint32)
+
+        self.produced = 0
+        self.consumed = 0
+        self.dropped = 0 # overwritten before they were read
+
+        self.read_seq = 0 # first unread frame
+
+        self.cond = threading.Condition()
+
+    # Producer
+    def slot(self):
+
+        return self.frames[self.produced % self.size]
+
+    def commit(self, t, trig_word = 0):
+
+        with self.cond:
+
+            i = self.produced % self.size
+
+            self.times[i] = t
+            self.trig_words[i] = trig_word
+
+            self.produced = self.produced + 1
+
+            oldest = self.produced - self.size + 1
+
+            if (self.read_seq < oldest):
+
+                self.dropped = self.dropped + oldest - self.read_seq
+
+                self.read_seq = oldest
+
+            self.cond.notify_all()
+
+    # Consumers
+    def valid(self, seq):
+
+        return seq > self.produced - self.size
+
+    def get(self, seq):
+
+        i = seq % self.size
+
+        return seq, self.times[i], self.frames[i]
+
+    def latest(self):
+
+        # Newest frame, it stays unread
+        with self.cond:
+
+            if (self.produced == 0):
+
+                return None
+
+            return self.get(self.produced - 1)
+
+    def wait_next(self, timeout = None):
+
+        with self.cond:
+
+            if not self.cond.wait_for(lambda: self.read_seq < self.produced,
+                                      timeout):
+
+                return None
+
+            seq = self.read_seq
+
+            self.read_seq = seq + 1
+            self.consumed = self.consumed + 1
+
+            return self.get(seq)
+
+    def drain(self):
+
+        with self.cond:
+
+            seqs = range(self.read_seq, self.produced)
+
+            self.read_seq = self.produced
+            self.consumed = self.consumed + len(seqs)
+
+            return [self.get(seq) for seq in seqs]
+
+    def counters(self):
+
+        with self.cond:
+
+            return {'produced': self.produced,
+                    'consumed': self.consumed,
+                    'dropped': self.dropped,
+                    'unread': self.produced - self.read_seq}
+
+#%% Rolling window
+
+class RollingWindow:
+
+    # Last size samples of 4 channels. Every sample is stored twice, at i and
+    # i + size, so the window is always one contiguous view.
+
+    def __init__(self, size, dtype = np.uint8):
+
+        self.size = size
+
+        self.buf = np.zeros((4, 2 * size), dtype = dtype)
+
+        self.pos = 0
+        self.samples = 0
+
+    def append(self, chunk):
+
+        # chunk (4, k)
+        k = chunk.shape[1]
+
+        if (k >= self.size):
+
+            chunk = chunk[:, k - self.size:]
+
+            k = self.size
+
+        i = self.pos
+
+        j = min(k, self.size - i)
+
+        self.buf[:, i:i + j] = chunk[:, :j]
+        self.buf[:, i + self.size:i + self.size + j] = chunk[:, :j]
+
+        self.buf[:, :k - j] = chunk[:, j:]
+        self.buf[:, self.size:self.size + k - j] = chunk[:, j:]
+
+        self.pos = (i + k) % self.size
+        self.samples = self.samples + chunk.shape[1]
+
+    def view(self):
+
+        # (4, n) oldest sample first, n < size until the window is filled
+        n = min(self.samples, self.size)
+
+        return self.buf[:, self.pos + self.size - n:self.pos + self.size]
+
+#%% Acquisition thread
+
+class Acquisition(threading.Thread):
+
+    # Reads frames of pyhantek6254BC.Hantek into a FrameRing in the
+    # background, the consumers never block USB reads
+
+    def __init__(self, hantek, size = 16):
+
+        super().__init__(daemon = True)
+
+        self.hantek = hantek
+
+        self.ring = FrameRing(size, hantek.buf_len)
+
+        self.stop_event = threading.Event()
+
+        self.error = None
+
+    def run(self):
+
+        h0 = self.hantek
+
+        try:
+
+            for raw in h0.stream(raw = True):
+
+                np.copyto(self.ring.slot(), raw.T)
+
+                self.ring.commit(time.time(), h0.trig_word)
+
+                if self.stop_event.is_set():
+
+                    break
+
+        except Exception as e:
+
+            self.error = e
+
+            raise
+
+        finally:
+
+            with self.ring.cond:
+
+                self.ring.cond.notify_all()
+
+    def stop(self, timeout = None):
+
+        self.stop_event.set()
+
+        self.join(timeout)
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import pyhantek6254BC
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    acq = Acquisition(h0, size = 8)
+
+    acq.start()
+
+    for i in range(10):
+
+        frame = acq.ring.wait_next(timeout = 1.)
+
+        # Slow consumer
+        time.sleep(0.1)
+
+    time.sleep(0.5)
+
+    print('Unread frames:', len(acq.ring.drain()))
+
+    acq.stop()
+
+    print(acq.ring.counters())
+
+    h0.close()
+
+#%% End
@@ -0,0 +1,375 @@
+import lzma
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+import pyhantek6254BC
+
+#%% File format
+
+# Header | chunk | chunk | ... | index | trailer
+#
+# A chunk holds up to chunk_frames frames (4, buf_len) uint8, every channel
+# is delta encoded (first sample, then differences modulo 256) and the whole
+# chunk is compressed. The index at the end holds the offset, size, first
+# frame and time span of every chunk and the timestamp and trigger word of
+# every frame, the trailer points to it.
+MAGIC = b'HT6254CZ'
+VERSION = 1
+
+CODECS = {'zlib': 1, 'lzma': 2}
+
+HEADER = np.dtype([('magic', 'S8'),
+                   ('version', '<u4'),
+                   ('codec', '<u4'),
+                   ('chunk_frames', '<u4'),
+                   ('buf_len', '<u4'),
+                   ('samplerate', '<u8'),
+                   ('chvdiv', '<f8', (4,)),
+                   ('trig_source', '<u1'),
+                   ('trig_slope', '<u1'),
+                   ('trig_sweep_mode', 'S8'),
+                   ('h_trig_level', '<i4'),
+                   ('v_trig_level', '<i4')])
+
+CHUNK = np.dtype([('offset', '<u8'),
+                  ('size', '<u4'),
+                  ('first_frame', '<u4'),
+                  ('frames', '<u4'),
+                  ('t_first', '<f8'),
+                  ('t_last', '<f8')])
+
+# index offset, chunks, frames, magic
+TRAILER = struct.Struct('<QII8s')
+
+def delta_encode(frames, out):
+
+    out[..., 0] = frames[..., 0]
+
+    np.subtract(frames[..., 1:], frames[..., :-1], out = out[..., 1:])
+
+    return out
+
+def delta_decode(data):
+
+    # Sum modulo 256
+    return np.cumsum(data, axis = -1, dtype = np.uint8)
+
+def compress(data, codec, level):
+
+    if (codec == 'lzma'):
+
+        return lzma.compress(data, preset = 6 if level is None else level)
+
+    return zlib.compress(data, 6 if level is None else level)
+
+def decompress(data, codec):
+
+    if (codec == 'lzma'):
+
+        return lzma.decompress(data)
+
+    return zlib.decompress(data)
+
+#%% Writer
+
+class ArchiveWriter:
+
+    # append() only copies the frame into the current chunk buffer, the
+    # encoding, compression and file writes are done by a worker thread.
+    # When the worker is behind, new chunk buffers are allocated instead of
+    # waiting for it.
+
+    def __init__(self, path, hantek, codec = 'zlib', level = None,
+                 chunk_frames = 64):
+
+        if (codec not in CODECS):
+
+            raise ValueError('Available codecs: %s' % list(CODECS))
+
+        h0 = hantek
+
+        self.hantek = h0
+        self.codec = codec
+        self.level = level
+        self.chunk_frames = chunk_frames
+        self.buf_len = h0.buf_len
+
+        head = np.zeros(1, dtype = HEADER)[0]
+
+        head['magic'] = MAGIC
+        head['version'] = VERSION
+        head['codec'] = CODECS[codec]
+        head['chunk_frames'] = chunk_frames
+        head['buf_len'] = h0.buf_len
+        head['samplerate'] = h0.samplerate
+        head['chvdiv'] = h0.ChVDiv
+        head['trig_source'] = h0.trig_source
+        head['trig_slope'] = h0.trig_slope
+        head['trig_sweep_mode'] = h0.trig_sweep_mode.encode()
+        head['h_trig_level'] = h0.h_trig_level
+        head['v_trig_level'] = h0.v_trig_level
+
+        self.f = open(path, 'wb')
+
+        self.f.write(head.tobytes())
+
+        self.chunks = []
+        self.times = []
+        self.trig_words = []
+
+        self.free = queue.Queue()
+        self.todo = queue.Queue()
+
+        for i in range(3):
+
+            self.free.put(self.new_buffer())
+
+        self.buf = self.free.get()
+        self.n = 0
+        self.frames = 0
+
+        self.error = None
+
+        self.worker = threading.Thread(target = self.work, daemon = True)
+
+        self.worker.start()
+
+    def new_buffer(self):
+
+        return np.empty((self.chunk_frames, 4, self.buf_len), dtype = np.uint8)
+
+    def append(self, raw, t = None, trig_word = 0):
+
+        # raw - interleaved uint8 frame (buf_len, 4) or (4, buf_len) channels
+        raw = np.asarray(raw, dtype = np.uint8)
+
+        if (raw.shape == (4, self.buf_len)):
+
+            self.buf[self.n] = raw
+
+        else:
+
+            self.buf[self.n] = raw.reshape((-1, 4)).T
+
+        self.times.append(time.time() if t is None else t)
+        self.trig_words.append(trig_word)
+
+        self.n = self.n + 1
+        self.frames = self.frames + 1
+
+        if (self.n == self.chunk_frames):
+
+            self.flush()
+
+    def flush(self):
+
+        if (self.n == 0):
+
+            return
+
+        self.todo.put((self.buf, self.n, self.frames - self.n,
+                       self.times[-self.n], self.times[-1]))
+
+        try:
+
+            self.buf = self.free.get_nowait()
+
+        except queue.Empty:
+
+            self.buf = self.new_buffer()
+
+        self.n = 0
+
+    def work(self):
+
+        delta = self.new_buffer()
+
+        while True:
+
+            item = self.todo.get()
+
+            if item is None:
+
+                return
+
+            buf, n, first, t_first, t_last = item
+
+            try:
+
+                delta_encode(buf[:n], delta[:n])
+
+                self.free.put(buf)
+
+                data = compress(delta[:n].tobytes(), self.codec, self.level)
+
+                offset = self.f.tell()
+
+                self.f.write(data)
+
+                self.chunks.append((offset, len(data), first, n, t_first,
+                                    t_last))
+
+            except Exception as e:
+
+                self.error = e
+
+    def record(self, frames):
+
+        h0 = self.hantek
+
+        for raw in h0.stream(frames, raw = True):
+
+            self.append(raw, time.time(), h0.trig_word)
+
+    def close(self):
+
+        self.flush()
+
+        self.todo.put(None)
+
+        self.worker.join()
+
+        if self.error is not None:
+
+            raise self.error
+
+        offset = self.f.tell()
+
+        self.f.write(np.array(self.chunks, dtype = CHUNK).tobytes())
+        self.f.write(np.array(self.times, dtype = '<f8').tobytes())
+        self.f.write(np.array(self.trig_words, dtype = '<u4').tobytes())
+
+        self.f.write(TRAILER.pack(offset, len(self.chunks), self.frames, MAGIC))
+
+        self.f.close()
+
+#%% Reader
+
+class ArchiveReader:
+
+    # Random access to frames, only the chunk of a frame is decompressed,
+    # the last decoded chunk is kept
+
+    def __init__(self, path):
+
+        self.f = open(path, 'rb')
+
+        head = np.frombuffer(self.f.read(HEADER.itemsize), dtype = HEADER)[0]
+
+        self.f.seek(-TRAILER.size, 2)
+
+        offset, chunks, frames, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+
+        if (head['magic'] != MAGIC) or (magic != MAGIC):
+
+            raise ValueError('Not a Hantek archive: %s' % path)
+
+        self.codec = {v: k for k, v in CODECS.items()}[int(head['codec'])]
+        self.buf_len = int(head['buf_len'])
+        self.samplerate = int(head['samplerate'])
+        self.ChVDiv = [float(v) for v in head['chvdiv']]
+        self.trig_source = int(head['trig_source'])
+        self.trig_slope = int(head['trig_slope'])
+        self.trig_sweep_mode = head['trig_sweep_mode'].decode()
+        self.h_trig_level = int(head['h_trig_level'])
+        self.v_trig_level = int(head['v_trig_level'])
+
+        self.f.seek(offset)
+
+        self.chunks = np.frombuffer(self.f.read(chunks * CHUNK.itemsize),
+                                    dtype = CHUNK)
+
+        self.times = np.frombuffer(self.f.read(8 * frames), dtype = '<f8')
+        self.trig_words = np.frombuffer(self.f.read(4 * frames), dtype = '<u4')
+
+        self.lut = pyhantek6254BC.volts_lut(self.ChVDiv)
+
+        self.time = np.arange(self.buf_len) / self.samplerate
+
+        self.cached = -1
+        self.data = None
+
+    def __len__(self):
+
+        return len(self.times)
+
+    def get_chunk(self, k):
+
+        if (k != self.cached):
+
+            c = self.chunks[k]
+
+            self.f.seek(int(c['offset']))
+
+            data = decompress(self.f.read(int(c['size'])), self.codec)
+
+            data = np.frombuffer(data, dtype = np.uint8)
+
+            self.data = delta_decode(data.reshape((-1, 4, self.buf_len)))
+            self.cached = k
+
+        return self.data
+
+    def frame(self, i):
+
+        # (4, buf_len) uint8
+        if not (0 <= i < len(self)):
+
+            raise IndexError('Frame %d of %d' % (i, len(self)))
+
+        k = np.searchsorted(self.chunks['first_frame'], i, side = 'right') - 1
+
+        return self.get_chunk(k)[i - int(self.chunks[k]['first_frame'])]
+
+    def frame_at(self, t):
+
+        # Index of the last frame taken not later than t
+        return max(int(np.searchsorted(self.times, t, side = 'right')) - 1, 0)
+
+    def volts(self, i, out = None):
+
+        raw = self.frame(i)
+
+        if out is None:
+
+            out = np.empty((4, self.buf_len), dtype = self.lut.dtype)
+
+        for ch in range(4):
+
+            np.take(self.lut[ch], raw[ch], out = out[ch], mode = 'clip')
+
+        return out
+
+    def close(self):
+
+        self.f.close()
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import os
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    arc = ArchiveWriter('capture.hcz', h0, chunk_frames = 16)
+
+    arc.record(50)
+
+    arc.close()
+
+    h0.close()
+
+    arc = ArchiveReader('capture.hcz')
+
+    print(len(arc), 'frames, %.1f kB' % (os.path.getsize('capture.hcz') / 1e3))
+
+    Ch1, Ch2, Ch3, Ch4 = arc.volts(len(arc) // 2)
+
+    arc.close()
+
+#%% End
@@ -0,0 +1,260 @@
+import asyncio
+import concurrent.futures
+import functools
+import time
+import numpy as np
+import pyhantek6254BC
+
+#%% asyncio facade
+
+class AsyncHantek:
+
+    # USB transfers of pyhantek6254BC.Hantek run one at a time on a dedicated
+    # executor thread, waiting for the data is done with asyncio.sleep, so
+    # the event loop keeps running during long captures.
+
+    def __init__(self, hantek, executor = None):
+
+        if executor is None:
+
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = 1, thread_name_prefix = 'hantek-usb')
+
+        self.hantek = hantek
+        self.executor = executor
+
+        self.lock = asyncio.Lock()
+
+        # stream() holds the lock until it ends, the task iterating over it
+        self.streaming = False
+        self.stream_task = None
+
+    @classmethod
+    async def connect(cls, transport = None):
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = 1, thread_name_prefix = 'hantek-usb')
+
+        loop = asyncio.get_running_loop()
+
+        h0 = await loop.run_in_executor(executor, pyhantek6254BC.Hantek,
+                                        transport)
+
+        return cls(h0, executor)
+
+    async def run(self, func, *args, **kwargs):
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(func, *args,
+                                                            **kwargs))
+
+    async def check_stream(self):
+
+        # Other tasks wait for the lock. The task iterating over stream()
+        # would wait for itself forever: after a break the loop closes the
+        # generator a few iterations later, otherwise the stream must be
+        # closed first.
+        for i in range(4):
+
+            if not (self.streaming and
+                    (asyncio.current_task() is self.stream_task)):
+
+                return
+
+            await asyncio.sleep(0)
+
+        raise RuntimeError('A stream is running in this task, close it first')
+
+    async def configure(self, fast = False):
+
+        await self.check_stream()
+
+        async with self.lock:
+
+            await self.run(self.hantek.Configure, fast = fast)
+
+    async def apply(self, fast = False):
+
+        await self.check_stream()
+
+        async with self.lock:
+
+            return await self.run(self.hantek.apply, fast = fast)
+
+    async def wait_state(self):
+
+        # Hantek.GetState with asyncio.sleep
+        h0 = self.hantek
+
+        if not h0.poll_state:
+
+            await asyncio.sleep(h0.buf_len / h0.samplerate * 1.5 + 0.005)
+
+            return 0
+
+        t_ready, t_end, max_delay = h0.GetStateTiming()
+
+        delay = 1e-4
+
+        await asyncio.sleep(max(t_ready - time.perf_counter(), 0.))
+
+        while True:
+
+            state = await self.run(h0.ReadState)
+
+            if (state & pyhantek6254BC.STATE_COMPLETE):
+
+                return state
+
+            if (time.perf_counter() + delay > t_end):
+
+                return state
+
+            await asyncio.sleep(delay)
+
+            delay = min(2. * delay, max_delay)
+
+    async def read_frame(self):
+
+        # After the start: wait, trigger position, readout
+        h0 = self.hantek
+
+        await self.wait_state()
+
+        await self.run(h0.GetTrigger)
+
+        return await self.run(h0.ReadData, h0.GetRawBuffer())
+
+    async def get_data(self, out = None):
+
+        h0 = self.hantek
+
+        await self.check_stream()
+
+        async with self.lock:
+
+            await self.run(h0.StartCollectData)
+
+            data = await self.read_frame()
+
+            return await self.run(h0.ConvertData, data, out)
+
+    async def get_raw_frame(self):
+
+        h0 = self.hantek
+
+        await self.check_stream()
+
+        async with self.lock:
+
+            await self.run(h0.StartCollectData)
+
+            data = await self.read_frame()
+
+            return np.frombuffer(data, dtype = np.uint8).reshape((-1, 4)).copy()
+
+    async def stream(self, frames = None, raw = False):
+
+        # As Hantek.stream, the next capture starts before the frame is
+        # converted and handed out. The lock is held from the first start to
+        # the end of the stream, calls of other tasks wait meanwhile; after a
+        # break the stream ends when the generator is closed
+        # (contextlib.aclosing closes it at once).
+        h0 = self.hantek
+
+        await self.check_stream()
+
+        n = 0
+
+        async with self.lock:
+
+            self.streaming = True
+            self.stream_task = asyncio.current_task()
+
+            try:
+
+                await self.run(h0.StartCollectData)
+
+                while (frames is None) or (n < frames):
+
+                    data = await self.read_frame()
+
+                    n = n + 1
+
+                    if (frames is None) or (n < frames):
+
+                        await self.run(h0.StartCollectData)
+
+                    if raw:
+
+                        frame = np.frombuffer(data, dtype = np.uint8)
+                        frame = frame.reshape((-1, 4)).copy()
+
+                    else:
+
+                        frame = await self.run(h0.ConvertData, data)
+
+                    yield frame
+
+            finally:
+
+                self.streaming = False
+                self.stream_task = None
+
+    async def close(self):
+
+        async with self.lock:
+
+            await self.run(self.hantek.close)
+
+        self.executor.shutdown()
+
+    async def __aenter__(self):
+
+        return self
+
+    async def __aexit__(self, *exc):
+
+        await self.close()
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import hantek_sim
+
+    async def ticker(period):
+
+        n = 0
+
+        while True:
+
+            await asyncio.sleep(period)
+
+            n = n + 1
+
+            print('tick', n)
+
+    async def main():
+
+        scope = await AsyncHantek.connect(hantek_sim.SimTransport())
+
+        scope.hantek.set_samplerate(25_000)
+
+        await scope.configure(fast = True)
+
+        task = asyncio.create_task(ticker(0.1))
+
+        async with scope:
+
+            async for Ch1, Ch2, Ch3, Ch4 in scope.stream(3):
+
+                print('frame', Ch1.shape)
+
+        task.cancel()
+
+    asyncio.run(main())
+
+#%% End
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition benchmark of pyhantek6254BC.Hantek
+
+python hantek_bench.py -o results.json
+python hantek_bench.py --rates 2500000 25000000 --compare results.json
+"""
+
+import argparse, contextlib, io, json, platform, subprocess, sys, time
+import tracemalloc
+import numpy as np
+import pyhantek6254BC
+import hantek_sim
+import hantek_dsp
+
+#%% Funcs
+
+# 0x0F and 0x10 commands sent by the former if-chain of SetSampleRate,
+# (samplerate, buf_len): (0x0F, 0x10) in hex
+TIMEBASE_GOLDEN = {(125, 4096): ('0f003f420f00', '10001ce10780000000128c7a0000'),
+                   (125, 8192): ('0f003f420f00', '10001ce119fa000000129ef40000'),
+                   (125, 16384): ('0f003f420f00', '10001ce13dee00000012c2e80000'),
+                   (250, 4096): ('0f001fa10700', '10009cf0034000000009463d0000'),
+                   (250, 8192): ('0f001fa10700', '10009cf00c7d000000094f7a0000'),
+                   (250, 16384): ('0f001fa10700', '10009cf01ef70000000961f40000'),
+                   (500, 4096): ('0f008fd00300', '10005cf8012000008004a31e0000'),
+                   (500, 8192): ('0f008fd00300', '10005c78863e00008084273d0000'),
+                   (500, 16384): ('0f008fd00300', '10005c788f7b00008084307a0000'),
+                   (1250, 4096): ('0f009f860000', '10009c96cd0c00000035410c0000'),
+                   (1250, 8192): ('0f009f860000', '10009c9602190000003576180000'),
+                   (1250, 16384): ('0f009f860000', '10009c966c3100000035e0300000'),
+                   (2500, 4096): ('0f004fc30000', '10005c4bb6180000801a70180000'),
+                   (2500, 8192): ('0f004fc30000', '10005c4b20310000801ada300000'),
+                   (2500, 16384): ('0f004fc30000', '10005c4bf4610000801aae610000'),
+                   (5000, 4096): ('0f00a7610000', '1000bc6533030000400dd7300000'),
+                   (5000, 8192): ('0f00a7610000', '1000bca540060000400dab610000'),
+                   (5000, 16384): ('0f00a7610000', '1000bc255b0c0000400d53c30000'),
+                   (12500, 4096): ('0f000f270000', '10005cc24701000080b839010000'),
+                   (12500, 8192): ('0f000f270000', '10005c4280020000803872020000'),
+                   (12500, 16384): ('0f000f270000', '10005c42f10400008038e3040000'),
+                   (25000, 4096): ('0f0087130000', '10003ce1a300000040dc9c000000'),
+                   (25000, 8192): ('0f0087130000', '10003c2140010000401c39010000'),
+                   (25000, 16384): ('0f0087130000', '10003ca178020000409c71020000'),
+                   (50000, 4096): ('0f00c3090000', '1000acf051000000206e4e000000'),
+                   (50000, 8192): ('0f00c3090000', '1000ac10a0000000208e9c000000'),
+                   (50000, 16384): ('0f00c3090000', '1000ac503c01000020ce38010000'),
+                   (125000, 4096): ('0f00e7030000', '1000bcc620000000405f1f000000'),
+                   (125000, 8192): ('0f00e7030000', '1000bc0640000000409f3e000000'),
+                   (125000, 16384): ('0f00e7030000', '1000bc867e000000401f7d000000'),
+                   (250000, 4096): ('0f00f3010000', '10006c6310000000a0af0f000000'),
+                   (250000, 8192): ('0f00f3010000', '10006c0320000000a04f1f000000'),
+                   (250000, 16384): ('0f00f3010000', '10006c433f000000a08f3e000000'),
+                   (500000, 4096): ('0f00f9000000', '1000c43108000000d0d707000000'),
+                   (500000, 8192): ('0f00f9000000', '1000c40110000000d0a70f000000'),
+                   (500000, 16384): ('0f00f9000000', '1000c4a11f000000d0471f000000'),
+                   (1250000, 4096): ('0f0063000000', '10002c4703000000202303000000'),
+                   (1250000, 8192): ('0f0063000000', '10002c6706000000204306000000'),
+                   (1250000, 16384): ('0f0063000000', '10002ca70c00000020830c000000'),
+                   (2500000, 4096): ('0f0031000000', '1000a4a301000000909101000000'),
+                   (2500000, 8192): ('0f0031000000', '1000a43303000000902103000000'),
+                   (2500000, 16384): ('0f0031000000', '1000a45306000000904106000000'),
+                   (5000000, 4096): ('0f0018000000', '1000e0d100000000c8c800000000'),
+                   (5000000, 8192): ('0f0018000000', '1000e09901000000c89001000000'),
+                   (5000000, 16384): ('0f0018000000', '1000e02903000000c82003000000'),
+                   (12500000, 4096): ('0f0009000000', '1000045400000000505000000000'),
+                   (12500000, 8192): ('0f0009000000', '100004a40000000050a000000000'),
+                   (12500000, 16384): ('0f0009000000', '1000044401000000504001000000'),
+                   (25000000, 4096): ('0f0004000000', '1000102a00000000282800000000'),
+                   (25000000, 8192): ('0f0004000000', '1000105200000000285000000000'),
+                   (25000000, 16384): ('0f0004000000', '100010a20000000028a000000000'),
+                   (50000000, 4096): ('0f0001000000', '1000161500000000141400000000'),
+                   (50000000, 8192): ('0f0001000000', '1000162900000000142800000000'),
+                   (50000000, 16384): ('0f0001000000', '1000165100000000145000000000'),
+                   (125000000, 4096): ('0f0000000000', '1000800800000000080800000000'),
+                   (125000000, 8192): ('0f0000000000', '1000801000000000081000000000'),
+                   (125000000, 16384): ('0f0000000000', '1000802000000000082000000000'),
+                   (250000000, 4096): ('0f0000000000', '10004e0400000000040400000000'),
+                   (250000000, 8192): ('0f0000000000', '10004e0800000000040800000000'),
+                   (250000000, 16384): ('0f0000000000', '10004e1000000000041000000000')}
+
+STAGES = ['StartCollectData', 'GetState', 'GetTrigger', 'ReadData',
+          'ConvertData']
+
+def quiet(func, *args):
+
+    # The setters of Hantek print every change
+    with contextlib.redirect_stdout(io.StringIO()):
+
+        return func(*args)
+
+def stats(values):
+
+    values = np.asarray(values)
+
+    return {'mean': float(values.mean()),
+            'median': float(np.median(values)),
+            'min': float(values.min()),
+            'max': float(values.max())}
+
+def run_stages(h0):
+
+    t = [time.perf_counter()]
+
+    h0.StartCollectData()
+    t.append(time.perf_counter())
+
+    h0.GetState()
+    t.append(time.perf_counter())
+
+    h0.GetTrigger()
+    t.append(time.perf_counter())
+
+    data = h0.ReadData(h0.GetRawBuffer())
+    t.append(time.perf_counter())
+
+    h0.ConvertData(data)
+    t.append(time.perf_counter())
+
+    return np.diff(t)
+
+def bench_point(h0, samplerate, buf_len, frames, max_time):
+
+    quiet(h0.set_buf_len, buf_len)
+    quiet(h0.set_samplerate, samplerate)
+    quiet(h0.Configure)
+
+    # Warm up
+    h0.GetData()
+
+    # Whole frames
+    n = 0
+    t0 = time.perf_counter()
+
+    while (n < frames):
+
+        h0.GetData()
+
+        n = n + 1
+
+        if (time.perf_counter() - t0 > max_time):
+
+            break
+
+    dt = time.perf_counter() - t0
+
+    # Pipelined frames
+    t0 = time.perf_counter()
+
+    for data in h0.stream(n, reuse = True):
+
+        pass
+
+    dt_stream = time.perf_counter() - t0
+
+    # Stage breakdown
+    st = []
+    t0 = time.perf_counter()
+
+    while (len(st) < n):
+
+        st.append(run_stages(h0))
+
+        if (time.perf_counter() - t0 > max_time):
+
+            break
+
+    st = np.array(st)
+
+    return {'samplerate': samplerate,
+            'buf_len': buf_len,
+            'frames': n,
+            'fps': n / dt,
+            'bytes_per_s': n * 4 * buf_len / dt,
+            'stream_fps': n / dt_stream,
+            'acquisition_s': buf_len / samplerate,
+            'stages': {name: stats(st[:, i]) for i, name in enumerate(STAGES)}}
+
+def bench_configure(h0, runs):
+
+    res = {}
+
+    for fast in [False, True]:
+
+        dt = []
+
+        for i in range(runs):
+
+            t0 = time.perf_counter()
+
+            h0.Configure(fast = fast)
+
+            dt.append(time.perf_counter() - t0)
+
+        res['fast' if fast else 'normal'] = stats(dt)
+
+    return res
+
+def check_timebase():
+
+    cmds = pyhantek6254BC.TIMEBASE_CMDS
+
+    ok = True
+
+    for key in sorted(set(cmds) | set(TIMEBASE_GOLDEN)):
+
+        sent = tuple(cmd.hex() for cmd in cmds[key]) if key in cmds else None
+
+        if (sent != TIMEBASE_GOLDEN.get(key)):
+
+            print('Timebase %d S/s, %d: %s, expected %s' %
+                  (key + (sent, TIMEBASE_GOLDEN.get(key))))
+
+            ok = False
+
+    print('Timebase commands:', 'OK' if ok else 'MISMATCH')
+
+    return ok
+
+def check_usb_transport():
+
+    # The default UsbTransport on a fake pyusb device: init, configure and
+    # a frame through the real ctrl / write / read calls
+    try:
+
+        with hantek_sim.fake_pyusb():
+
+            h0 = quiet(pyhantek6254BC.Hantek)
+
+            quiet(h0.Configure)
+
+            Ch1, Ch2, Ch3, Ch4 = h0.GetData()
+
+            ok = isinstance(h0.transport, pyhantek6254BC.UsbTransport) and \
+                 (len(Ch1) == h0.buf_len)
+
+            quiet(h0.close)
+
+    except Exception as e:
+
+        print('UsbTransport:', repr(e))
+
+        ok = False
+
+    print('UsbTransport:', 'OK' if ok else 'FAIL')
+
+    return ok
+
+def check_allocations(frames = 20):
+
+    # Memory allocated by GetData(reuse = True) in the steady state, the
+    # simulator itself does not allocate per frame
+    h0 = quiet(pyhantek6254BC.Hantek, hantek_sim.SimTransport())
+
+    quiet(h0.set_samplerate, 250_000_000)
+    quiet(h0.Configure)
+
+    frame = 4 * h0.buf_len
+
+    for i in range(3):
+
+        h0.GetData(reuse = True)
+
+    tracemalloc.start()
+
+    base = tracemalloc.get_traced_memory()[0]
+
+    for i in range(frames):
+
+        h0.GetData(reuse = True)
+
+    current, peak = tracemalloc.get_traced_memory()
+
+    tracemalloc.stop()
+
+    quiet(h0.close)
+
+    ok = (current - base < 1024) and (peak - base < frame // 16)
+
+    print('Allocations: %d B retained, %d B peak (frame %d B):' %
+          (current - base, peak - base, frame), 'OK' if ok else 'FAIL')
+
+    return ok
+
+def bench_decimate(buf_len = 16384, columns = 1000, runs = 100):
+
+    # Cost of the min / max decimation and, if pyqtgraph is available,
+    # of setData with full and decimated frames
+    data = np.random.default_rng(0).normal(size = (4, buf_len)).astype(np.float32)
+    t = np.arange(buf_len, dtype = float)
+
+    dec = hantek_dsp.MinMaxDecimator(buf_len, columns)
+
+    td = dec.time(t)
+
+    res = {'buf_len': buf_len, 'columns': columns,
+           'points_full': 4 * buf_len, 'points_decimated': 8 * columns}
+
+    t0 = time.perf_counter()
+
+    for i in range(runs):
+
+        dec.decimate(data)
+
+    res['decimate_s'] = (time.perf_counter() - t0) / runs
+
+    try:
+
+        import pyqtgraph as pg
+
+    except ImportError:
+
+        print('pyqtgraph is not available, setData is not measured')
+
+        return res
+
+    app = pg.mkQApp()
+
+    win = pg.GraphicsLayoutWidget()
+
+    curves = [win.addPlot(row = i // 2, col = i % 2).plot() for i in range(4)]
+
+    win.show()
+
+    for name, x, y in [('setData_full_s', t, data),
+                       ('setData_decimated_s', td, dec.decimate(data))]:
+
+        t0 = time.perf_counter()
+
+        for i in range(runs):
+
+            for j in range(4):
+
+                curves[j].setData(x, y[j])
+
+            app.processEvents()
+
+        res[name] = (time.perf_counter() - t0) / runs
+
+    win.close()
+
+    return res
+
+def git_commit():
+
+    try:
+
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr = subprocess.DEVNULL,
+                                       text = True).strip()
+
+    except (OSError, subprocess.CalledProcessError):
+
+        return None
+
+def compare(old, new):
+
+    for mode in new['configure']:
+
+        a = old.get('configure', {}).get(mode, {}).get('mean')
+        b = new['configure'][mode]['mean']
+
+        if (a):
+
+            print('Configure %8s %9.3f ms -> %9.3f ms' % (mode, 1e3 * a, 1e3 * b))
+
+    old = {(r['samplerate'], r['buf_len']): r for r in old['results']}
+
+    print('%12s %6s %10s %10s %7s' % ('samplerate', 'len', 'fps old', 'fps new',
+                                       'ratio'))
+
+    for r in new['results']:
+
+        o = old.get((r['samplerate'], r['buf_len']))
+
+        if (o is None):
+
+            continue
+
+        print('%12d %6d %10.2f %10.2f %7.2f' % (r['samplerate'], r['buf_len'],
+                                                 o['fps'], r['fps'],
+                                                 r['fps'] / o['fps']))
+
+        for name in STAGES:
+
+            a = o['stages'].get(name, {}).get('mean')
+            b = r['stages'][name]['mean']
+
+            if (a):
+
+                print('%31s %9.3f ms -> %9.3f ms' % (name, 1e3 * a, 1e3 * b))
+
+def report(r):
+
+    print('%12d S/s %6d: %8.2f frames / s, %10.3e B / s, stream %8.2f frames / s'
+          % (r['samplerate'], r['buf_len'], r['fps'], r['bytes_per_s'],
+             r['stream_fps']))
+
+    for name in STAGES:
+
+        print('%31s %9.3f ms' % (name, 1e3 * r['stages'][name]['mean']))
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = 'Hantek 6254BC benchmark')
+
+    parser.add_argument('--usb', action = 'store_true',
+                        help = 'use the real scope instead of the simulator')
+    parser.add_argument('--rates', type = int, nargs = '+',
+                        help = 'sample rates, all of dictSR_N by default')
+    parser.add_argument('--buf-lens', type = int, nargs = '+',
+                        help = 'buffer lengths, all of buf_lens by default')
+    parser.add_argument('--frames', type = int, default = 50)
+    parser.add_argument('--max-time', type = float, default = 5.,
+                        help = 'time limit of every point, s')
+    parser.add_argument('--configure-runs', type = int, default = 10)
+    parser.add_argument('--decimate', action = 'store_true',
+                        help = 'only benchmark the display decimation and exit')
+    parser.add_argument('--check', action = 'store_true',
+                        help = 'only run the protocol, transport and allocation checks and exit')
+    parser.add_argument('-o', '--output', help = 'JSON results file')
+    parser.add_argument('--compare', help = 'JSON results of an older run')
+
+    args = parser.parse_args(argv)
+
+    if (args.check):
+
+        ok = check_timebase()
+        ok = check_usb_transport() and ok
+        ok = check_allocations() and ok
+
+        sys.exit(0 if ok else 1)
+
+    if (args.decimate):
+
+        r = bench_decimate()
+
+        for k, v in r.items():
+
+            print('%20s' % k, v)
+
+        if (args.output):
+
+            with open(args.output, 'w') as f:
+
+                json.dump(r, f, indent = 1)
+
+        return r
+
+    transport = None if args.usb else hantek_sim.SimTransport()
+
+    h0 = quiet(pyhantek6254BC.Hantek, transport)
+
+    rates = args.rates or sorted(h0.dictSR_N.values())
+    buf_lens = args.buf_lens or h0.buf_lens
+
+    results = {'commit': git_commit(),
+               'python': platform.python_version(),
+               'transport': 'usb' if args.usb else 'sim',
+               'configure': bench_configure(h0, args.configure_runs),
+               'results': []}
+
+    for mode, r in results['configure'].items():
+
+        print('Configure %8s %9.3f ms' % (mode, 1e3 * r['mean']))
+
+    for bl in buf_lens:
+
+        for sr in rates:
+
+            r = bench_point(h0, sr, bl, args.frames, args.max_time)
+
+            results['results'].append(r)
+
+            report(r)
+
+    quiet(h0.close)
+
+    if (args.output):
+
+        with open(args.output, 'w') as f:
+
+            json.dump(results, f, indent = 1)
+
+    if (args.compare):
+
+        with open(args.compare) as f:
+
+            compare(json.load(f), results)
+
+    return results
+
+#%% Main
+
+if __name__ == "__main__":
+
+    main()
+
+#%% End
@@ -0,0 +1,417 @@
+import numpy as np
+
+#%% Min / max decimation
+
+class MinMaxDecimator:
+
+    # Reduces (..., n) frames to (..., 2 * columns) pairs of min and max of
+    # every column, short glitches stay visible. Unequal columns when n is
+    # not a multiple of columns.
+
+    def __init__(self, n, columns):
+
+        columns = min(columns, n)
+
+        self.n = n
+        self.columns = columns
+
+        self.idx = (np.arange(columns) * n) // columns
+
+        self.out = {}
+
+    def get_out(self, shape, dtype):
+
+        key = (shape, np.dtype(dtype))
+
+        if (key not in self.out):
+
+            self.out[key] = np.empty(shape[:-1] + (2 * self.columns,),
+                                     dtype = dtype)
+
+        return self.out[key]
+
+    def decimate(self, data, out = None):
+
+        if isinstance(data, (list, tuple)):
+
+            # Channels as separate arrays, without stacking them
+            if out is None:
+
+                out = self.get_out((len(data), self.n), data[0].dtype)
+
+            for i in range(len(data)):
+
+                self.decimate(data[i], out[i])
+
+            return out
+
+        data = np.asarray(data)
+
+        if out is None:
+
+            out = self.get_out(data.shape, data.dtype)
+
+        np.minimum.reduceat(data, self.idx, axis = -1, out = out[..., 0::2])
+        np.maximum.reduceat(data, self.idx, axis = -1, out = out[..., 1::2])
+
+        return out
+
+    def time(self, t):
+
+        # Both points of a column are drawn at its first sample
+        return np.repeat(np.asarray(t)[self.idx], 2)
+
+def minmax_decimate(data, columns):
+
+    data = np.asarray(data)
+
+    return MinMaxDecimator(data.shape[-1], columns).decimate(data).copy()
+
+#%% Accumulators
+
+# Frames are (4, n) ADC codes uint8, e.g. Hantek.GetRawFrame().T or the
+# frames of Hantek.stream(raw = True) transposed (views, no copy). All the
+# state is allocated once, add() works in place in integer arithmetic.
+
+def codes_to_volts(codes, lut, out = None):
+
+    # The code -> volts table of Hantek.GetLUT is linear, fractional codes
+    # of the averages are converted without rounding
+    lut = np.asarray(lut)
+
+    if out is None:
+
+        out = np.empty(codes.shape, dtype = lut.dtype)
+
+    np.multiply(codes, lut[:, 1:2] - lut[:, 0:1], out = out)
+    np.add(out, lut[:, 0:1], out = out)
+
+    return out
+
+class RunningAverage:
+
+    # Mean of the last frames frames: sum in uint32 and a ring of the added
+    # frames, the oldest one is subtracted when a new one comes
+
+    def __init__(self, n, frames):
+
+        self.frames = frames
+
+        self.sum = np.zeros((4, n), dtype = np.uint32)
+
+        self.ring = np.zeros((frames, 4, n), dtype = np.uint8)
+
+        self.count = 0
+
+    def reset(self):
+
+        self.sum.fill(0)
+
+        self.count = 0
+
+    def add(self, frame):
+
+        slot = self.ring[self.count % self.frames]
+
+        if (self.count >= self.frames):
+
+            np.subtract(self.sum, slot, out = self.sum)
+
+        np.add(self.sum, frame, out = self.sum)
+
+        np.copyto(slot, frame)
+
+        self.count = self.count + 1
+
+    def average(self, out = None):
+
+        # Codes, float32
+        if out is None:
+
+            out = np.empty(self.sum.shape, dtype = np.float32)
+
+        np.multiply(self.sum, 1. / max(min(self.count, self.frames), 1),
+                    out = out)
+
+        return out
+
+class ExpAverage:
+
+    # avg += (frame - avg) / 2 ** shift in fixed point with 8 fractional bits
+
+    FRAC = 8
+
+    def __init__(self, n, shift = 4):
+
+        self.shift = shift
+
+        self.acc = np.zeros((4, n), dtype = np.int32)
+        self.tmp = np.zeros((4, n), dtype = np.int32)
+
+        self.count = 0
+
+    def reset(self):
+
+        self.count = 0
+
+    def add(self, frame):
+
+        np.left_shift(frame, self.FRAC, out = self.tmp, dtype = np.int32)
+
+        if (self.count == 0):
+
+            # Starts from the first frame, not from zero
+            np.copyto(self.acc, self.tmp)
+
+        else:
+
+            np.subtract(self.tmp, self.acc, out = self.tmp)
+            np.right_shift(self.tmp, self.shift, out = self.tmp)
+            np.add(self.acc, self.tmp, out = self.acc)
+
+        self.count = self.count + 1
+
+    def average(self, out = None):
+
+        if out is None:
+
+            out = np.empty(self.acc.shape, dtype = np.float32)
+
+        np.multiply(self.acc, 1. / (1 << self.FRAC), out = out)
+
+        return out
+
+class PeakDetect:
+
+    # Min / max envelopes of all frames since reset()
+
+    def __init__(self, n):
+
+        self.min = np.empty((4, n), dtype = np.uint8)
+        self.max = np.empty((4, n), dtype = np.uint8)
+
+        self.reset()
+
+    def reset(self):
+
+        self.min.fill(255)
+        self.max.fill(0)
+
+        self.count = 0
+
+    def add(self, frame):
+
+        np.minimum(self.min, frame, out = self.min)
+        np.maximum(self.max, frame, out = self.max)
+
+        self.count = self.count + 1
+
+class Persistence:
+
+    # Hit counts (4, 256, columns) of every code in every screen column.
+    # fade() halves the counts, older frames fade out.
+
+    def __init__(self, n, columns = 1000):
+
+        columns = min(columns, n)
+
+        self.columns = columns
+
+        self.counts = np.zeros((4, 256, columns), dtype = np.uint32)
+
+        # Flat index of (channel, code 0, column of the sample)
+        col = (np.arange(n) * columns) // n
+
+        self.base = (np.arange(4)[:, None] * 256 * columns + col).astype(np.intp)
+
+        self.idx = np.empty((4, n), dtype = np.intp)
+
+    def reset(self):
+
+        self.counts.fill(0)
+
+    def add(self, frame):
+
+        np.multiply(frame, self.columns, out = self.idx, dtype = np.intp)
+        np.add(self.idx, self.base, out = self.idx)
+
+        # uint32 one, a Python int makes add.at take the slow casting path
+        np.add.at(self.counts.reshape(-1), self.idx.reshape(-1), np.uint32(1))
+
+    def fade(self, shift = 1):
+
+        np.right_shift(self.counts, shift, out = self.counts)
+
+#%% Software trigger
+
+class SoftTrigger:
+
+    # Edge trigger on the frames: first crossing of level on the source
+    # channel with the slope (0 - RISE, 1 - FALL), interpolated between
+    # samples. Before a crossing counts the signal has to be hysteresis
+    # below (RISE) or above (FALL) the level, noise on the edge does not
+    # trigger again. pre samples before the crossing and length samples in
+    # the aligned window (half of the frame by default).
+
+    def __init__(self, level, slope = 0, source = 0, pre = 0, length = None,
+                 hysteresis = 2):
+
+        self.level = level
+        self.slope = slope
+        self.source = source
+        self.pre = pre
+        self.length = length
+        self.hysteresis = hysteresis
+
+        self.tmp = None
+
+    @classmethod
+    def from_hantek(cls, hantek, length = None, hysteresis = 2, volts = False):
+
+        # Level, slope and source of the hardware trigger, the crossing at
+        # the same place of the window as h_trig_level (0 - center, 50 -
+        # start). Level in codes for raw frames, volts = True for GetData.
+        h0 = hantek
+
+        if length is None:
+
+            length = h0.buf_len // 2
+
+        pre = int((50 - h0.h_trig_level) / 100. * length)
+
+        level = h0.v_trig_level
+
+        if volts:
+
+            level = float(h0.GetLUT(np.float64)[h0.trig_source][level])
+            hysteresis = hysteresis * 10. * h0.ChVDiv[h0.trig_source] / 255.
+
+        return cls(level, h0.trig_slope, h0.trig_source, pre, length,
+                   hysteresis)
+
+    def get_length(self, n):
+
+        if self.length is None:
+
+            return n // 2
+
+        return self.length
+
+    def find(self, frames):
+
+        # frames (..., 4, n), crossing positions (...) in samples, NaN
+        # where the frame has none with a full window around it
+        frames = np.asarray(frames)
+
+        x = frames[..., self.source, :]
+
+        shape = x.shape[:-1]
+        n = x.shape[-1]
+
+        x = x.reshape((-1, n))
+
+        lo = self.pre
+        hi = n - self.get_length(n) + self.pre
+
+        if (self.slope == 0):
+
+            cand = (x[:, :-1] < self.level) & (x[:, 1:] >= self.level)
+            armed = x < self.level - self.hysteresis
+
+        else:
+
+            cand = (x[:, :-1] > self.level) & (x[:, 1:] <= self.level)
+            armed = x > self.level + self.hysteresis
+
+        # Flat positions row * n + i, sorted
+        row, i = np.nonzero(cand)
+
+        c = row * n + i
+
+        a = np.flatnonzero(armed)
+
+        # Last armed sample before every crossing, it must be after the
+        # previous crossing of the same row
+        j = np.searchsorted(a, c, side = 'right') - 1
+
+        last = np.where(j >= 0, a[np.maximum(j, 0)], -1)
+
+        prev = np.concatenate(([-1], c[:-1]))
+        prev = np.where(prev // n == row, prev, row * n - 1)
+
+        ok = (last > prev) & (last >= row * n) & (i >= lo) & (i < hi)
+
+        row, i = row[ok], i[ok]
+
+        t = np.full(len(x), np.nan)
+
+        # First valid crossing of every row
+        first = np.searchsorted(row, np.arange(len(x)))
+
+        has = first < len(row)
+        has[has] = row[first[has]] == np.arange(len(x))[has]
+
+        k = i[first[has]]
+
+        r = np.flatnonzero(has)
+
+        x0 = x[r, k].astype(float)
+        x1 = x[r, k + 1].astype(float)
+
+        t[has] = k + (self.level - x0) / (x1 - x0)
+
+        return t.reshape(shape)
+
+    def window(self, frame, t = None):
+
+        # Zero-copy (4, length) window of the frame starting pre samples
+        # before the crossing and the crossing position in the window.
+        # None without a crossing.
+        if t is None:
+
+            t = self.find(frame)
+
+        if np.isnan(t):
+
+            return None, t
+
+        k = int(t)
+
+        start = k - self.pre
+
+        return frame[:, start:start + self.get_length(frame.shape[-1])], t - k + self.pre
+
+    def align(self, frame, out = None):
+
+        # (4, length) frame interpolated between samples, the crossing is
+        # exactly at sample pre. None without a crossing.
+        t = self.find(frame)
+
+        if np.isnan(t):
+
+            return None
+
+        k = int(t)
+
+        frac = t - k
+
+        start = k - self.pre
+
+        n = self.get_length(frame.shape[-1])
+
+        if out is None:
+
+            out = np.empty((frame.shape[0], n), dtype = np.float32)
+
+        if (self.tmp is None) or (self.tmp.shape != out.shape):
+
+            self.tmp = np.empty(out.shape, dtype = np.float32)
+
+        np.multiply(frame[:, start:start + n], 1. - frac, out = out)
+        np.multiply(frame[:, start + 1:start + n + 1], frac, out = self.tmp)
+
+        out += self.tmp
+
+        return out
+
+#%% End
@@ -7,6 +7,7 @@ Created on %(date)s
 
 import numpy as np, pylab as pl, sys, os
 import pyhantek6254BC
+import hantek_dsp
 
 #%%% Hantek setup
 
@@ -53,6 +54,14 @@ Ch1, Ch2, Ch3, Ch4 = h0.GetData()
 
 h0.close()
 
+#%%% Min / max of every screen column
+
+dec = hantek_dsp.MinMaxDecimator(len(t), 1000)
+
+t = dec.time(t)
+
+Ch1, Ch2, Ch3, Ch4 = dec.decimate([Ch1, Ch2, Ch3, Ch4])
+
 #%%% Graphics
 
 pl.figure()
@@ -0,0 +1,380 @@
+import numpy as np
+
+#%% Measurements
+
+# Every measurement is a (4,) array, one value per channel, NaN when it is
+# not defined (no edges in the frame)
+NAMES = ['vmin', 'vmax', 'vpp', 'base', 'top', 'mean', 'rms', 'frequency',
+         'period', 'duty', 'rise', 'fall']
+
+class Measure:
+
+    # All measurements of all 4 channels of a frame at once. Frames are
+    # measured in codes: levels come from one histogram of the frame, edges
+    # from threshold crossings, and only the results are converted to volts
+    # with the LUT of the current ChVDiv. Frames in volts (GetData) are
+    # rounded back to codes with the same LUT, so both give the same
+    # results. The list of GetRawData is taken as float codes.
+
+    def __init__(self, hantek, low = 0.1, high = 0.9):
+
+        self.hantek = hantek
+
+        # Rise / fall time levels, part of top - base
+        self.low = low
+        self.high = high
+
+        # Part of the samples on one code for a flat base or top level
+        self.flat = 0.05
+
+        self.n = None
+
+    def setup(self, n):
+
+        if (n == self.n):
+
+            return
+
+        self.n = n
+
+        # Histogram index of every sample: 256 * channel + code
+        self.base_idx = (256 * np.arange(4, dtype = np.intp))[:, None]
+        self.idx = np.empty((4, n), dtype = np.intp)
+
+        self.above = np.empty((4, n), dtype = bool)
+        self.armed = np.empty((4, n), dtype = bool)
+
+        self.codes = np.arange(256)
+
+        # Volts -> codes
+        self.tmp = np.empty((4, n))
+        self.raw = np.empty((4, n), dtype = np.uint8)
+
+    def levels(self, frame):
+
+        # Codes: histograms of the 4 channels in one bincount call
+        np.add(frame, self.base_idx, out = self.idx)
+
+        hist = np.bincount(self.idx.reshape(-1), minlength = 1024)
+        hist = hist.reshape((4, 256))
+
+        n = self.n
+
+        codes = self.codes
+
+        seen = hist > 0
+
+        vmin = np.argmax(seen, axis = 1).astype(float)
+        vmax = 255. - np.argmax(seen[:, ::-1], axis = 1)
+
+        mean = hist @ codes / n
+        msq = hist @ (codes * codes) / n
+
+        # Base and top: most frequent code below and above the middle, min
+        # and max when there is no flat level (sine, triangle)
+        mid = (vmin + vmax) / 2
+
+        lower = codes <= mid[:, None]
+
+        low_hist = np.where(lower, hist, -1)
+        high_hist = np.where(lower, -1, hist)
+
+        base = np.argmax(low_hist, axis = 1).astype(float)
+        top = np.argmax(high_hist, axis = 1).astype(float)
+
+        flat = self.flat * n
+
+        base = np.where(low_hist.max(axis = 1) >= flat, base, vmin)
+
+        # Constant channel: nothing above the middle
+        top = np.where(high_hist.max(axis = 1) >= flat, top, vmax)
+
+        return vmin, vmax, base, top, mean, msq
+
+    def to_codes(self, frame, scale, offset):
+
+        np.subtract(frame, offset[:, None], out = self.tmp)
+        np.divide(self.tmp, scale[:, None], out = self.tmp)
+
+        np.rint(self.tmp, out = self.tmp)
+        np.clip(self.tmp, 0, 255, out = self.tmp)
+
+        np.copyto(self.raw, self.tmp, casting = 'unsafe')
+
+        return self.raw
+
+    def crossings(self, frame, level, rising, arm = None):
+
+        # Global positions channel * n + sample of the crossings of level.
+        # With arm a crossing counts only when the signal has been below arm
+        # (rising) or above arm (falling) since the previous crossing of the
+        # channel, noise around level gives no extra edges.
+        np.greater(frame, level[:, None], out = self.above)
+
+        a = self.above
+
+        if rising:
+
+            edge = a[:, 1:] & ~a[:, :-1]
+
+        else:
+
+            edge = a[:, :-1] & ~a[:, 1:]
+
+        ch, i = np.nonzero(edge)
+
+        c = ch * self.n + i + 1
+
+        if arm is None:
+
+            return c
+
+        if rising:
+
+            np.less(frame, arm[:, None], out = self.armed)
+
+        else:
+
+            np.greater(frame, arm[:, None], out = self.armed)
+
+        armed = np.flatnonzero(self.armed)
+
+        if (len(armed) == 0):
+
+            return c[:0]
+
+        # Last armed sample before every crossing, it must be after the
+        # previous crossing of the same channel
+        j = np.searchsorted(armed, c) - 1
+
+        last = np.where(j >= 0, armed[np.maximum(j, 0)], -1)
+
+        prev = np.concatenate(([-1], c[:-1]))
+        prev = np.maximum(prev, ch * self.n - 1)
+
+        return c[last > prev]
+
+    def edge_times(self, first, second):
+
+        # For every crossing of the second level the last crossing of the
+        # first level before it, on the same channel
+        j = np.searchsorted(first, second, side = 'right') - 1
+
+        ok = j >= 0
+
+        second = second[ok]
+        first = first[j[ok]]
+
+        ok = (first // self.n) == (second // self.n)
+
+        ch = second[ok] // self.n
+
+        dt = (second[ok] - first[ok]).astype(float)
+
+        count = np.bincount(ch, minlength = 4)
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+
+            return np.bincount(ch, weights = dt, minlength = 4) / count
+
+    def measure(self, frame, codes = False):
+
+        # frame - (4, n) uint8 codes, 4 channels in volts (GetData) or the
+        # list of GetRawData. codes = True for other float arrays of codes.
+        h0 = self.hantek
+
+        if isinstance(frame, list) and (len(frame) == 6):
+
+            # Ch1 .. Ch4 of GetRawData are float codes, then state and
+            # trigger data
+            frame, codes = frame[:4], True
+
+        lut = h0.GetLUT(np.float64)
+
+        scale = lut[:, 1] - lut[:, 0]
+        offset = lut[:, 0]
+
+        n = len(frame[0])
+
+        self.setup(n)
+
+        if (isinstance(frame, np.ndarray) and (frame.dtype == np.uint8)):
+
+            pass
+
+        elif codes:
+
+            frame = self.to_codes(frame, np.ones(4), np.zeros(4))
+
+        else:
+
+            frame = self.to_codes(frame, scale, offset)
+
+        vmin, vmax, base, top, mean, msq = self.levels(frame)
+
+        amp = top - base
+
+        lo = base + self.low * amp
+        hi = base + self.high * amp
+
+        # Frequency, period, duty cycle: crossings of the middle level, armed
+        # by the low and high levels
+        mid = base + amp / 2
+
+        rise = self.crossings(frame, mid, True, lo)
+        fall = self.crossings(frame, mid, False, hi)
+
+        ch = rise // n
+
+        starts = np.searchsorted(ch, np.arange(5))
+
+        count = np.diff(starts)
+
+        has = count >= 2
+
+        first = np.where(has, rise[np.minimum(starts[:-1], len(rise) - 1)], 0)
+        last = np.where(has, rise[np.maximum(starts[1:] - 1, 0)], 0)
+
+        # High time of the whole periods: from every rise but the last one
+        # of the channel to the next fall
+        j = np.searchsorted(fall, rise)
+
+        ok = (rise < last[ch]) & (j < len(fall))
+
+        high = np.bincount(ch[ok], weights = fall[j[ok]] - rise[ok],
+                           minlength = 4)
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+
+            period = np.where(has, (last - first) / (count - 1), np.nan)
+
+            duty = np.where(has, high / (last - first), np.nan)
+
+        # Rise and fall times: from the last crossing of the low level to the
+        # armed crossing of the high one and back
+        rise_lo = self.crossings(frame, lo, True)
+        rise_hi = self.crossings(frame, hi, True, lo)
+
+        fall_hi = self.crossings(frame, hi, False)
+        fall_lo = self.crossings(frame, lo, False, hi)
+
+        t_rise = self.edge_times(rise_lo, rise_hi)
+        t_fall = self.edge_times(fall_hi, fall_lo)
+
+        # Codes -> volts only for the results
+        ts = 1. / h0.samplerate
+
+        res = {}
+
+        res['vmin'] = vmin * scale + offset
+        res['vmax'] = vmax * scale + offset
+        res['vpp'] = (vmax - vmin) * scale
+        res['base'] = base * scale + offset
+        res['top'] = top * scale + offset
+        res['mean'] = mean * scale + offset
+
+        # mean((a * c + b) ** 2)
+        res['rms'] = np.sqrt(scale ** 2 * msq + 2 * scale * offset * mean +
+                             offset ** 2)
+
+        res['period'] = period * ts
+        res['frequency'] = 1. / res['period']
+        res['duty'] = duty
+        res['rise'] = t_rise * ts
+        res['fall'] = t_fall * ts
+
+        return res
+
+#%% Running statistics
+
+class Statistics:
+
+    # min / max / mean / std of every measurement over frames (Welford),
+    # NaN values are skipped
+
+    def __init__(self, names = NAMES):
+
+        self.names = list(names)
+
+        shape = (len(self.names), 4)
+
+        self.values = np.empty(shape)
+
+        self.count = np.zeros(shape, dtype = np.int64)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def reset(self):
+
+        self.count.fill(0)
+        self.min.fill(np.inf)
+        self.max.fill(-np.inf)
+        self.mean.fill(0)
+        self.m2.fill(0)
+
+    def update(self, res):
+
+        x = self.values
+
+        for i, name in enumerate(self.names):
+
+            x[i] = res[name]
+
+        ok = ~np.isnan(x)
+
+        self.count += ok
+
+        np.fmin(self.min, x, out = self.min)
+        np.fmax(self.max, x, out = self.max)
+
+        d = np.where(ok, x - self.mean, 0.)
+
+        self.mean += d / np.maximum(self.count, 1)
+
+        self.m2 += d * np.where(ok, x - self.mean, 0.)
+
+    def std(self):
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+
+            return np.sqrt(self.m2 / (self.count - 1))
+
+    def snapshot(self):
+
+        std = self.std()
+
+        return {name: {'count': self.count[i].tolist(),
+                       'min': self.min[i].tolist(),
+                       'max': self.max[i].tolist(),
+                       'mean': self.mean[i].tolist(),
+                       'std': std[i].tolist()}
+                for i, name in enumerate(self.names)}
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import time
+    import pyhantek6254BC
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    m = Measure(h0)
+    stats = Statistics()
+
+    t0 = time.perf_counter()
+
+    for raw in h0.stream(50, raw = True):
+
+        stats.update(m.measure(raw.T))
+
+    print('%.1f frames / s' % (50 / (time.perf_counter() - t0)))
+
+    print('Ch1 Vpp, V:', stats.snapshot()['vpp']['mean'][0])
+
+    h0.close()
+
+#%% End
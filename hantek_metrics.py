@@ -0,0 +1,262 @@
+import bisect
+import os
+import socketserver
+import threading
+import time
+
+#%% Histograms
+
+# Upper bounds of the buckets, s
+BUCKETS = [1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2,
+           2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.]
+
+# Phase of a capture -> Hantek method
+PHASES = {'arm': 'StartCollectData',
+          'wait': 'GetState',
+          'trigger': 'GetTrigger',
+          'readout': 'ReadData',
+          'convert': 'ConvertData'}
+
+class Histogram:
+
+    # Fixed buckets, the last one for values above BUCKETS[-1]
+
+    def __init__(self, buckets = BUCKETS):
+
+        self.buckets = list(buckets)
+
+        self.counts = [0] * (len(self.buckets) + 1)
+
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+
+        return {'buckets': self.buckets + [float('inf')],
+                'counts': list(self.counts),
+                'sum': self.sum,
+                'count': self.count}
+
+#%% Metrics of a scope
+
+class Metrics:
+
+    # Histograms of the capture phases and counters of a Hantek, enable()
+    # turns the collection on
+
+    def __init__(self, hantek, buckets = BUCKETS):
+
+        self.hantek = hantek
+
+        self.phases = {name: Histogram(buckets) for name in PHASES}
+
+        # Exceptions raised in a phase (USB timeouts and errors)
+        self.errors = {name: 0 for name in PHASES}
+
+        self.frames = 0
+        self.bytes = 0
+
+        self.started = time.time()
+
+    def timed(self, name, func):
+
+        hist = self.phases[name]
+
+        def wrapper(*args, **kwargs):
+
+            t0 = time.perf_counter()
+
+            try:
+
+                return func(*args, **kwargs)
+
+            except Exception:
+
+                self.errors[name] += 1
+
+                raise
+
+            finally:
+
+                hist.observe(time.perf_counter() - t0)
+
+        return wrapper
+
+    def enable(self):
+
+        # The phase methods are shadowed on the instance, the driver code is
+        # not changed and costs nothing while metrics are off
+        h0 = self.hantek
+
+        for name, method in PHASES.items():
+
+            setattr(h0, method, self.timed(name, getattr(h0, method)))
+
+        read_data = h0.ReadData
+
+        def counted(*args, **kwargs):
+
+            data = read_data(*args, **kwargs)
+
+            self.frames += 1
+            self.bytes += len(data)
+
+            return data
+
+        h0.ReadData = counted
+
+        return self
+
+    def disable(self):
+
+        h0 = self.hantek
+
+        for method in list(PHASES.values()):
+
+            h0.__dict__.pop(method, None)
+
+    def snapshot(self):
+
+        h0 = self.hantek
+
+        return {'serial': getattr(h0, 'serial', None),
+                'uptime': time.time() - self.started,
+                'frames': self.frames,
+                'bytes': self.bytes,
+                'usb_errors': h0.usb_errors,
+                'usb_errors_ignored': h0.usb_errors_ignored,
+                'phase_errors': dict(self.errors),
+                'phases': {name: hist.snapshot()
+                           for name, hist in self.phases.items()}}
+
+    def prometheus(self):
+
+        return prometheus_text([self])
+
+#%% Prometheus text format
+
+def prometheus_text(metrics):
+
+    # Text exposition format of several scopes, label scope - EEPROM id
+    lines = []
+
+    def add(name, kind, text, samples):
+
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+        for labels, value in samples:
+
+            lines.append('%s{%s} %s' % (name, ','.join('%s="%s"' % kv
+                                                      for kv in labels),
+                                        repr(float(value))))
+
+    snaps = [(m.snapshot(), m) for m in metrics]
+
+    def scope(s, i):
+
+        return ('scope', s['serial'] or str(i))
+
+    for name, key, text in [('hantek_frames_total', 'frames', 'Frames read'),
+                            ('hantek_bytes_total', 'bytes', 'Bytes read'),
+                            ('hantek_usb_errors_total', 'usb_errors',
+                             'USB errors in control transfers'),
+                            ('hantek_usb_errors_ignored_total',
+                             'usb_errors_ignored',
+                             'Expected USB errors in control transfers')]:
+
+        add(name, 'counter', text,
+            [((scope(s, i),), s[key]) for i, (s, m) in enumerate(snaps)])
+
+    add('hantek_phase_errors_total', 'counter', 'Exceptions in capture phases',
+        [((scope(s, i), ('phase', phase)), n)
+         for i, (s, m) in enumerate(snaps)
+         for phase, n in s['phase_errors'].items()])
+
+    name = 'hantek_phase_seconds'
+
+    lines.append('# HELP %s Duration of capture phases' % name)
+    lines.append('# TYPE %s histogram' % name)
+
+    for i, (s, m) in enumerate(snaps):
+
+        for phase, h in s['phases'].items():
+
+            labels = 'scope="%s",phase="%s"' % (scope(s, i)[1], phase)
+
+            total = 0
+
+            for le, n in zip(h['buckets'], h['counts']):
+
+                total += n
+
+                le = '+Inf' if le == float('inf') else repr(le)
+
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, le,
+                                                          total))
+
+            lines.append('%s_sum{%s} %r' % (name, labels, h['sum']))
+            lines.append('%s_count{%s} %d' % (name, labels, h['count']))
+
+    return '\n'.join(lines) + '\n'
+
+def write_file(metrics, path):
+
+    # Atomic replace, for the node_exporter textfile collector
+    tmp = path + '.tmp'
+
+    with open(tmp, 'w') as f:
+
+        f.write(prometheus_text(metrics))
+
+    os.replace(tmp, path)
+
+def serve_unix(metrics, path):
+
+    # Every connection to the socket gets the current metrics text, the
+    # server runs in a daemon thread, server.shutdown() stops it
+    class Handler(socketserver.BaseRequestHandler):
+
+        def handle(self):
+
+            self.request.sendall(prometheus_text(metrics).encode())
+
+    if os.path.exists(path):
+
+        os.unlink(path)
+
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    return server
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import pyhantek6254BC
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    m = Metrics(h0).enable()
+
+    for frame in h0.stream(20, reuse = True):
+
+        pass
+
+    print(m.prometheus())
+
+    write_file([m], 'hantek.prom')
+
+    h0.close()
+
+#%% End
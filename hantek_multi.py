@@ -0,0 +1,197 @@
+import concurrent.futures
+import threading
+import time
+import numpy as np
+import pyhantek6254BC
+
+#%% Several scopes
+
+def open_all():
+
+    # Hantek for every connected 6254BC, sorted by the EEPROM identifier
+    devices = sorted(pyhantek6254BC.find_devices(),
+                     key = lambda d: (d['serial'] or '', d['bus'], d['address']))
+
+    return [pyhantek6254BC.Hantek(pyhantek6254BC.UsbTransport(bus = d['bus'],
+                                                              address = d['address']))
+            for d in devices]
+
+class MultiHantek:
+
+    # Arms and reads N scopes in parallel threads, one thread per scope.
+    # Frame sets are (N, 4, buf_len) uint8 or volts, channel k of scope i is
+    # frames[i, k].
+
+    def __init__(self, scopes):
+
+        self.scopes = list(scopes)
+
+        n = len(self.scopes)
+
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers = n, thread_name_prefix = 'hantek-multi')
+
+        # All scopes are started at the same moment
+        self.barrier = threading.Barrier(n)
+
+        self.armed = [False] * n
+        self.arm_times = np.zeros(n)
+
+        self.frames = None
+
+    def map(self, func, *args):
+
+        futures = [self.pool.submit(func, i, *args)
+                   for i in range(len(self.scopes))]
+
+        return [f.result() for f in futures]
+
+    def get_buffer(self):
+
+        buf_len = self.scopes[0].buf_len
+
+        for h0 in self.scopes:
+
+            if (h0.buf_len != buf_len):
+
+                raise ValueError('Buffer lengths of the scopes differ')
+
+        shape = (len(self.scopes), 4, buf_len)
+
+        if (self.frames is None) or (self.frames.shape != shape):
+
+            self.frames = np.empty(shape, dtype = np.uint8)
+
+        return self.frames
+
+    def configure(self, fast = False):
+
+        self.map(lambda i: self.scopes[i].Configure(fast = fast))
+
+    def apply(self, fast = False):
+
+        return self.map(lambda i: self.scopes[i].apply(fast = fast))
+
+    def arm(self, i):
+
+        self.scopes[i].StartCollectData()
+
+        self.arm_times[i] = time.time()
+        self.armed[i] = True
+
+    def read(self, i, out, rearm, sync):
+
+        h0 = self.scopes[i]
+
+        if not self.armed[i]:
+
+            if sync:
+
+                self.barrier.wait()
+
+            self.arm(i)
+
+        h0.GetState()
+
+        h0.GetTrigger()
+
+        data = h0.ReadData(h0.GetRawBuffer())
+
+        self.armed[i] = False
+
+        t = self.arm_times[i]
+
+        if rearm:
+
+            self.arm(i)
+
+        np.copyto(out[i], np.frombuffer(data, dtype = np.uint8).reshape((-1, 4)).T)
+
+        return t, h0.trig_word
+
+    def get_raw_frames(self, out = None):
+
+        # Synchronous start of all scopes, returns host time of the frame
+        # set, (N, 4, buf_len) uint8 frames, start times and trigger words
+        if out is None:
+
+            out = self.get_buffer().copy()
+
+        self.armed = [False] * len(self.scopes)
+
+        res = self.map(self.read, out, False, True)
+
+        t, trig_words = np.array(res).T
+
+        return float(t.min()), out, t, trig_words.astype(np.uint32)
+
+    def get_data(self):
+
+        t, raw, arm_times, trig_words = self.get_raw_frames(self.get_buffer())
+
+        volts = np.empty(raw.shape, dtype = self.scopes[0].dtype)
+
+        for i, h0 in enumerate(self.scopes):
+
+            lut = h0.GetLUT(volts.dtype.type)
+
+            for k in range(4):
+
+                np.take(lut[k], raw[i, k], out = volts[i, k], mode = 'clip')
+
+        return t, volts
+
+    def stream(self, frames = None):
+
+        # Pipelined as Hantek.stream, the first start is synchronous. The
+        # yielded array is overwritten by the next frame set.
+        out = self.get_buffer()
+
+        self.armed = [False] * len(self.scopes)
+
+        n = 0
+
+        while (frames is None) or (n < frames):
+
+            n = n + 1
+
+            rearm = (frames is None) or (n < frames)
+
+            res = self.map(self.read, out, rearm, n == 1)
+
+            t, trig_words = np.array(res).T
+
+            yield float(t.min()), out, t, trig_words.astype(np.uint32)
+
+    def close(self):
+
+        self.map(lambda i: self.scopes[i].close())
+
+        self.pool.shutdown()
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import hantek_sim
+
+    scopes = [pyhantek6254BC.Hantek(hantek_sim.SimTransport(seed = i,
+                                                           serial = b'SIM%d' % i))
+              for i in range(3)]
+
+    multi = MultiHantek(scopes)
+
+    t0 = time.perf_counter()
+
+    for t, frames, arm_times, trig_words in multi.stream(20):
+
+        pass
+
+    print('%d scopes: %.1f frame sets / s, spread of starts %.2e s' %
+          (len(scopes), 20 / (time.perf_counter() - t0), np.ptp(arm_times)))
+
+    print([h0.serial for h0 in scopes])
+
+    multi.close()
+
+#%% End
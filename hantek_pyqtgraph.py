@@ -5,16 +5,21 @@ Created on %(date)s
 @author: %(username)s
 """
 
-import numpy as np, pylab as pl, sys, os
 import pyhantek6254BC
-from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
+import hantek_shm
+import hantek_dsp
+from pyqtgraph.Qt import QtCore
 import pyqtgraph as pg
 import multiprocessing as mp
 import time
 
 #%% Funcs
 
-def updateGraph(qu1, chvd):
+def updateGraph(name, chvd):
+    
+    app = pg.mkQApp('Hantek 6254BC')
+    
+    reader = hantek_shm.FrameReader(name)
     
     pg_layout = pg.GraphicsLayoutWidget()
     
@@ -36,18 +41,57 @@ def updateGraph(qu1, chvd):
     p4.setYRange(-chvd[3] * 5, chvd[3] * 5, padding = 0)
     curve4 = p4.plot([], [], pen = pg.mkPen('c', width = 1))
     
-    while True:
+    # Redraw with the refresh rate of the screen
+    screen = app.primaryScreen()
+    
+    fps = screen.refreshRate() if screen is not None else 0.
+    
+    if not (fps > 0):
         
-        Dat = qu1.get()
+        fps = 60.
+    
+    stat = {'redraws': 0, 'dropped': 0, 't0': time.perf_counter()}
+    
+    def update():
         
-        curve1.setData(Dat[0], Dat[1])
-        curve2.setData(Dat[0], Dat[2])
-        curve3.setData(Dat[0], Dat[3])
-        curve4.setData(Dat[0], Dat[4])
+        # Only the newest frame, nothing to redraw without a new one
+        Dat = reader.read()
         
-        QtWidgets.QApplication.processEvents()
+        if Dat is None:
+            
+            return
         
-        time.sleep(0.01)
+        count, skipped, t, Chs = Dat
+        
+        curve1.setData(t, Chs[0])
+        curve2.setData(t, Chs[1])
+        curve3.setData(t, Chs[2])
+        curve4.setData(t, Chs[3])
+        
+        stat['redraws'] += 1
+        stat['dropped'] += skipped
+        
+        dt = time.perf_counter() - stat['t0']
+        
+        if (dt >= 1.):
+            
+            pg_layout.setWindowTitle('Hantek 6254BC: %.1f FPS, dropped %d frames'
+                                     % (stat['redraws'] / dt, stat['dropped']))
+            
+            stat['redraws'] = 0
+            stat['t0'] = time.perf_counter()
+    
+    timer = QtCore.QTimer()
+    
+    timer.timeout.connect(update)
+    
+    timer.start(max(int(1000. / fps), 1))
+    
+    pg.exec()
+    
+    timer.stop()
+    
+    reader.close()
 
 #%% Settings
 
@@ -87,31 +131,37 @@ t = h0.get_time()
 
 #%% Graph process
 
-que1 = mp.Queue()
+# Min / max pairs of every screen column instead of all samples
+COLUMNS = 1000
+
+dec = hantek_dsp.MinMaxDecimator(h0.buf_len, COLUMNS)
 
-graph_process = mp.Process(target = updateGraph, args = (que1, ChVDIV))
+# Newest frame in shared memory, the time axis is sent once
+writer = hantek_shm.FrameWriter(2 * COLUMNS)
+
+writer.set_time(dec.time(t))
+
+graph_process = mp.Process(target = updateGraph, args = (writer.name, ChVDIV))
 
 graph_process.start()
 
 #%%% Calculations
 
-while True:
+for Chs in h0.stream(reuse = True):
     
-    Ch1, Ch2, Ch3, Ch4 = h0.GetData()
-
-    que1.put((t, Ch1, Ch2, Ch3, Ch4))
+    writer.write(dec.decimate(Chs))
     
     # Ch1, Ch2, Ch3, Ch4, a, b = h0.GetRawData()
     
-    # que1.put((t, (Ch1 - 128.) / 255. * 10. * ChVDIV[0],
-    #              (Ch2 - 128.) / 255. * 10. * ChVDIV[1],
-    #              (Ch3 - 128.) / 255. * 10. * ChVDIV[2],
-    #              (Ch4 - 128.) / 255. * 10. * ChVDIV[3]))
-    
-    time.sleep(0.1)
+    # writer.write(((Ch1 - 128.) / 255. * 10. * ChVDIV[0],
+    #               (Ch2 - 128.) / 255. * 10. * ChVDIV[1],
+    #               (Ch3 - 128.) / 255. * 10. * ChVDIV[2],
+    #               (Ch4 - 128.) / 255. * 10. * ChVDIV[3]))
 
 graph_process.join()
 
+writer.close()
+
 h0.close()
 
 #%%%
@@ -0,0 +1,234 @@
+import time
+import numpy as np
+import pyhantek6254BC
+
+#%% File format
+
+# Header, per-frame timestamps (float64, s) and trigger words (uint32) for
+# capacity frames, then capacity raw frames (buf_len, 4) uint8 as read from
+# the scope. The file has its full size from the start.
+MAGIC = b'HT6254RW'
+VERSION = 1
+
+HEADER = np.dtype([('magic', 'S8'),
+                   ('version', '<u4'),
+                   ('capacity', '<u4'),
+                   ('frames', '<u4'),
+                   ('buf_len', '<u4'),
+                   ('samplerate', '<u8'),
+                   ('chvdiv', '<f8', (4,)),
+                   ('trig_source', '<u1'),
+                   ('trig_slope', '<u1'),
+                   ('trig_sweep_mode', 'S8'),
+                   ('h_trig_level', '<i4'),
+                   ('v_trig_level', '<i4')])
+
+HEADER_SIZE = 256
+
+def get_offsets(capacity):
+
+    times = HEADER_SIZE
+    trig_words = times + 8 * capacity
+
+    # Frames from a page boundary
+    frames = -(-(trig_words + 4 * capacity) // 4096) * 4096
+
+    return times, trig_words, frames
+
+def open_arrays(path, mode, capacity, buf_len):
+
+    times, trig_words, frames = get_offsets(capacity)
+
+    head = np.memmap(path, dtype = HEADER, mode = mode, shape = (1,))
+
+    t = np.memmap(path, dtype = '<f8', mode = mode, offset = times,
+                  shape = (capacity,))
+
+    tw = np.memmap(path, dtype = '<u4', mode = mode, offset = trig_words,
+                   shape = (capacity,))
+
+    raw = np.memmap(path, dtype = np.uint8, mode = mode, offset = frames,
+                    shape = (capacity, buf_len, 4))
+
+    return head, t, tw, raw
+
+#%% Recorder
+
+class RawRecorder:
+
+    # The capacity in frames is fixed when the file is created: the file gets
+    # its full size at once and is never grown or remapped, the offsets of
+    # the tables and frames depend on it. append() raises ValueError on a
+    # full file, record() stops at the capacity; a longer capture goes on
+    # in a new file.
+
+    def __init__(self, path, hantek, capacity):
+
+        h0 = hantek
+
+        self.hantek = h0
+        self.capacity = capacity
+
+        times, trig_words, frames = get_offsets(capacity)
+
+        with open(path, 'wb') as f:
+
+            f.truncate(frames + capacity * 4 * h0.buf_len)
+
+        self.head, self.times, self.trig_words, self.raw = \
+            open_arrays(path, 'r+', capacity, h0.buf_len)
+
+        head = self.head[0]
+
+        head['magic'] = MAGIC
+        head['version'] = VERSION
+        head['capacity'] = capacity
+        head['frames'] = 0
+        head['buf_len'] = h0.buf_len
+        head['samplerate'] = h0.samplerate
+        head['chvdiv'] = h0.ChVDiv
+        head['trig_source'] = h0.trig_source
+        head['trig_slope'] = h0.trig_slope
+        head['trig_sweep_mode'] = h0.trig_sweep_mode.encode()
+        head['h_trig_level'] = h0.h_trig_level
+        head['v_trig_level'] = h0.v_trig_level
+
+        self.frames = 0
+
+    def append(self, raw, t = None, trig_word = 0):
+
+        # raw - interleaved uint8 frame (buf_len, 4) or its bytes
+        if (self.frames >= self.capacity):
+
+            raise ValueError('Capture file is full: %d frames' % self.capacity)
+
+        i = self.frames
+
+        self.raw[i] = np.frombuffer(raw, dtype = np.uint8).reshape((-1, 4))
+
+        self.times[i] = time.time() if t is None else t
+        self.trig_words[i] = trig_word
+
+        # The frame counter last, a reader never sees a partial frame
+        self.frames = i + 1
+
+        self.head[0]['frames'] = self.frames
+
+    def record(self, frames = None):
+
+        # Continuous capture up to frames or to the file capacity
+        if (frames is None) or (frames > self.capacity - self.frames):
+
+            frames = self.capacity - self.frames
+
+        h0 = self.hantek
+
+        for raw in h0.stream(frames, raw = True):
+
+            self.append(raw, time.time(), h0.trig_word)
+
+    def close(self):
+
+        for mm in [self.head, self.times, self.trig_words, self.raw]:
+
+            mm.flush()
+
+        del self.head, self.times, self.trig_words, self.raw
+
+#%% Reader
+
+class RawReader:
+
+    # Frames are np.memmap views, volts are computed only on access
+
+    def __init__(self, path):
+
+        head = np.memmap(path, dtype = HEADER, mode = 'r', shape = (1,))[0]
+
+        if (head['magic'] != MAGIC):
+
+            raise ValueError('Not a Hantek raw capture: %s' % path)
+
+        self.capacity = int(head['capacity'])
+        self.buf_len = int(head['buf_len'])
+        self.samplerate = int(head['samplerate'])
+        self.ChVDiv = [float(v) for v in head['chvdiv']]
+        self.trig_source = int(head['trig_source'])
+        self.trig_slope = int(head['trig_slope'])
+        self.trig_sweep_mode = head['trig_sweep_mode'].decode()
+        self.h_trig_level = int(head['h_trig_level'])
+        self.v_trig_level = int(head['v_trig_level'])
+
+        self.head, times, trig_words, raw = \
+            open_arrays(path, 'r', self.capacity, self.buf_len)
+
+        n = len(self)
+
+        self.times = times[:n]
+        self.trig_words = trig_words[:n]
+        self.raw = raw[:n]
+
+        self.lut = pyhantek6254BC.volts_lut(self.ChVDiv)
+
+        self.time = np.arange(self.buf_len) / self.samplerate
+
+    def __len__(self):
+
+        return int(self.head[0]['frames'])
+
+    def frame(self, i):
+
+        # (buf_len, 4) uint8
+        return self.raw[i]
+
+    def channel(self, i, ch):
+
+        return self.raw[i, :, ch]
+
+    def volts(self, i, out = None):
+
+        raw = self.raw[i]
+
+        if out is None:
+
+            out = np.empty((4, self.buf_len), dtype = self.lut.dtype)
+
+        for ch in range(4):
+
+            np.take(self.lut[ch], raw[:, ch], out = out[ch], mode = 'clip')
+
+        return out
+
+    def __getitem__(self, i):
+
+        return self.volts(i)
+
+    def __iter__(self):
+
+        for i in range(len(self.raw)):
+
+            yield self.volts(i)
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    rec = RawRecorder('capture.raw', h0, capacity = 100)
+
+    rec.record(20)
+
+    rec.close()
+
+    h0.close()
+
+    capture = RawReader('capture.raw')
+
+    print(len(capture), 'frames,', capture.samplerate, 'S/s')
+
+    Ch1, Ch2, Ch3, Ch4 = capture[0]
+
+#%% End
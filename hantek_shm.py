@@ -0,0 +1,197 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+#%% Layout
+
+# Header of int64 values
+LATEST = 0 # slot of the newest complete frame, -1 - none
+COUNT = 1 # number of written frames
+TIME_SEQ = 2 # time axis version, odd while it is written
+SLOTS = 4
+MAX_LEN = 5
+DTYPE = 6
+SEQ = 8 # slot versions, odd while a slot is written, then slot lengths
+# (samples per channel), a length is valid under the version of its slot
+
+DTYPES = {1: np.uint8, 2: np.float32}
+
+def get_size(max_len, slots, dtype):
+
+    header = 8 * (SEQ + 2 * slots)
+    time_axis = 8 * max_len
+    frames = slots * 4 * max_len * np.dtype(dtype).itemsize
+
+    return header, time_axis, frames
+
+def get_arrays(buf, max_len, slots, dtype):
+
+    header, time_axis, frames = get_size(max_len, slots, dtype)
+
+    head = np.ndarray(SEQ + 2 * slots, dtype = np.int64, buffer = buf)
+
+    t = np.ndarray(max_len, dtype = np.float64, buffer = buf, offset = header)
+
+    data = np.ndarray((slots, 4, max_len), dtype = dtype, buffer = buf,
+                      offset = header + time_axis)
+
+    return head, t, data
+
+#%% Writer
+
+class FrameWriter:
+
+    # Acquisition side. Frames go into one of slots buffers, never into the
+    # newest one, so a reader can always copy the newest complete frame.
+
+    def __init__(self, max_len, dtype = np.float32, slots = 3):
+
+        code = {np.dtype(v): k for k, v in DTYPES.items()}[np.dtype(dtype)]
+
+        self.shm = shared_memory.SharedMemory(create = True,
+                                              size = sum(get_size(max_len,
+                                                                  slots,
+                                                                  dtype)))
+
+        self.name = self.shm.name
+
+        self.head, self.t, self.data = get_arrays(self.shm.buf, max_len,
+                                                  slots, dtype)
+
+        self.head[:] = 0
+        self.head[LATEST] = -1
+        self.head[SLOTS] = slots
+        self.head[MAX_LEN] = max_len
+        self.head[DTYPE] = code
+
+        self.slots = slots
+        self.max_len = max_len
+
+    def set_time(self, t):
+
+        # Only when the timebase or the frame length changes
+        self.head[TIME_SEQ] += 1
+
+        self.t[:len(t)] = t
+
+        self.head[TIME_SEQ] += 1
+
+    def write(self, frame):
+
+        # frame - (4, n) array or 4 channels
+        n = len(frame[0])
+
+        slot = (self.head[LATEST] + 1) % self.slots
+
+        self.head[SEQ + slot] += 1
+
+        self.head[SEQ + self.slots + slot] = n
+
+        for i in range(4):
+
+            self.data[slot, i, :n] = frame[i]
+
+        self.head[SEQ + slot] += 1
+
+        self.head[LATEST] = slot
+        self.head[COUNT] += 1
+
+    def close(self):
+
+        del self.head, self.t, self.data
+
+        self.shm.close()
+        self.shm.unlink()
+
+#%% Reader
+
+class FrameReader:
+
+    # Display side. read() copies the newest complete frame into own
+    # buffers, returns None if there is no new frame.
+
+    def __init__(self, name):
+
+        self.shm = shared_memory.SharedMemory(name = name)
+
+        head = np.ndarray(SEQ, dtype = np.int64, buffer = self.shm.buf)
+
+        slots = int(head[SLOTS])
+        max_len = int(head[MAX_LEN])
+        dtype = DTYPES[int(head[DTYPE])]
+
+        del head
+
+        self.head, self.t, self.data = get_arrays(self.shm.buf, max_len,
+                                                  slots, dtype)
+
+        self.frame = np.empty((4, max_len), dtype = dtype)
+        self.time = np.empty(max_len)
+
+        self.slots = slots
+
+        self.time_seq = 0
+        self.count = 0
+
+    def read_time(self):
+
+        while True:
+
+            seq = self.head[TIME_SEQ]
+
+            if (seq & 1):
+
+                continue
+
+            self.time[:] = self.t
+
+            if (self.head[TIME_SEQ] == seq):
+
+                self.time_seq = seq
+
+                return
+
+    def read(self):
+
+        while True:
+
+            count = int(self.head[COUNT])
+
+            if (count == self.count):
+
+                return None
+
+            slot = int(self.head[LATEST])
+
+            seq = self.head[SEQ + slot]
+
+            if (seq & 1):
+
+                continue
+
+            n = int(self.head[SEQ + self.slots + slot])
+
+            np.copyto(self.frame[:, :n], self.data[slot, :, :n])
+
+            if (self.head[SEQ + slot] != seq):
+
+                # Overwritten while copying, the length too
+                continue
+
+            if (self.head[TIME_SEQ] != self.time_seq):
+
+                self.read_time()
+
+            # Number of frames skipped since the previous read
+            skipped = count - self.count - 1
+
+            self.count = count
+
+            return count, skipped, self.time[:n], self.frame[:, :n]
+
+    def close(self):
+
+        del self.head, self.t, self.data
+
+        self.shm.close()
+
+#%% End
@@ -0,0 +1,386 @@
+import array
+import contextlib
+import time
+import numpy as np
+import usb.core
+import usb.util
+import pyhantek6254BC
+
+#%% Simulated device
+
+class SimTransport:
+
+    # Drop-in replacement of pyhantek6254BC.UsbTransport. It understands the
+    # command set sent by pyhantek6254BC.Hantek and answers with synthetic
+    # 4-channel data, delays model a USB 2.0 high-speed link.
+
+    def __init__(self, ctrl_latency = 250e-6, write_latency = 125e-6,
+                 read_latency = 125e-6, bulk_rate = 35e6, noise = 2,
+                 seed = 0, record = False, serial = b'SIM6254BC'):
+
+        self.ctrl_latency = ctrl_latency
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.bulk_rate = bulk_rate # bytes / s
+        self.noise = noise # codes
+
+        self.rng = np.random.default_rng(seed)
+
+        # Periods of the test signals per channel buffer
+        self.cycles = (4., 6.5, 10., 2.5)
+        self.amplitudes = (80, 60, 40, 100)
+
+        # Device state
+        self.divider = 0 # 0x0F
+        self.ram_ctrl = 0x3D # 0x12
+        self.trig_source = 0
+        self.trig_level = 128 # 0x07
+        self.trig_slope = 0 # 0x11
+        self.sweep = 0 # 0x03
+        self.adc = {} # 0x08, register -> value
+        self.read_addr = 0 # 0x0E
+
+        # 0x10 command -> (samplerate, buf_len)
+        self.timebases = {cmds[1]: key for key, cmds in
+                          pyhantek6254BC.TIMEBASE_CMDS.items()}
+
+        self.samplerate = None
+        self.armed_at = None
+        self.buf_len = 16 * 1024
+        self.offset = 0
+
+        self.response = None
+        self.tables = {}
+
+        # EEPROM contents
+        self.eeprom = {0x1580: bytes([0x01, 0x62, 0x54]) + serial,
+                       0x15e0: bytes(8)}
+
+        # Written bulk commands, for protocol checks
+        self.writes = [] if record else None
+
+    def wait(self, dt):
+
+        if (dt > 0):
+
+            time.sleep(dt)
+
+    def get_samplerate(self):
+
+        if self.samplerate is not None:
+
+            return self.samplerate
+
+        if (self.divider == 0):
+
+            if (self.ram_ctrl == 0x3C):
+
+                return 250_000_000
+
+            return 125_000_000
+
+        elif (self.divider == 1):
+
+            return 50_000_000
+
+        return 125_000_000 // (self.divider + 1)
+
+    def get_table(self, n):
+
+        # Two buffers of a periodic signal with noise, frames are windows of it
+        if (n not in self.tables):
+
+            x = np.arange(2 * n) / n
+
+            s = np.empty((2 * n, 4))
+
+            s[:, 0] = np.sin(2. * np.pi * self.cycles[0] * x)
+            s[:, 1] = np.sign(np.sin(2. * np.pi * self.cycles[1] * x))
+            s[:, 2] = 2. * np.abs(2. * ((self.cycles[2] * x) % 1.) - 1.) - 1.
+            s[:, 3] = np.sin(2. * np.pi * self.cycles[3] * x) * \
+                      np.cos(2. * np.pi * 5. * self.cycles[3] * x)
+
+            s = s * np.array(self.amplitudes) + 128.
+
+            if (self.noise > 0):
+
+                s = s + self.rng.normal(0., self.noise, s.shape)
+
+            self.tables[n] = np.clip(s, 0, 255).astype(np.uint8).tobytes()
+
+        return self.tables[n]
+
+    def get_frame(self, n):
+
+        # First n samples of the current buffer, without a copy
+        table = self.get_table(self.buf_len)
+
+        return memoryview(table)[4 * self.offset:4 * (self.offset + n)]
+
+    def get_state(self):
+
+        # bit 0 - triggered, bit 1 - collection is finished
+        if (self.armed_at is None):
+
+            return 0
+
+        elapsed = time.perf_counter() - self.armed_at
+
+        acq = self.buf_len / self.get_samplerate()
+
+        state = 0
+
+        if (elapsed >= acq / 2):
+
+            state = state | 0x01
+
+        if (elapsed >= acq):
+
+            state = state | 0x03
+
+        return state
+
+    # USB interface
+    def ctrl_transfer(self, rtype, req, wValue, wIndex, data):
+
+        self.wait(self.ctrl_latency)
+
+        if (rtype & 0x80 == 0):
+
+            return len(data)
+
+        if (req == 178):
+
+            # 512 bytes bulk packets, high speed
+            ret = bytes([0x01]) + bytes(data - 1)
+
+        elif (req == 162):
+
+            ret = self.eeprom.get(wValue, b'').ljust(data, b'\x00')[:data]
+
+        else:
+
+            ret = bytes(data)
+
+        return array.array('B', ret)
+
+    def write(self, data):
+
+        data = bytes(data)
+
+        self.wait(self.write_latency)
+
+        if (self.writes is not None):
+
+            self.writes.append(data)
+
+        op = data[0]
+
+        if (op == 0x0C):
+
+            self.response = bytes([0x0C, 0x01]).ljust(64, b'\x00')
+
+        elif (op == 0x08):
+
+            self.adc[data[5]] = data[2:5]
+
+        elif (op == 0x0F):
+
+            self.divider = data[2] | data[3] << 8 | data[4] << 16
+
+        elif (op == 0x10):
+
+            if (data in self.timebases):
+
+                self.samplerate, self.buf_len = self.timebases[data]
+
+        elif (op == 0x12):
+
+            self.ram_ctrl = data[2]
+            self.trig_source = data[5]
+
+        elif (op == 0x07):
+
+            self.trig_level = data[18]
+
+        elif (op == 0x11):
+
+            self.trig_slope = data[3]
+
+        elif (op == 0x03):
+
+            self.sweep = data[2]
+            self.armed_at = time.perf_counter()
+            self.offset = int(self.rng.integers(self.buf_len))
+
+        elif (op == 0x06):
+
+            self.response = bytes([self.get_state()]).ljust(512, b'\x00')
+
+        elif (op == 0x0D):
+
+            trig = (self.offset * 4) & 0xFFFF
+
+            self.response = bytes([0x0D, self.offset & 0x07,
+                                   trig & 0xFF, trig >> 8]).ljust(512, b'\x00')
+
+        elif (op == 0x0E):
+
+            self.read_addr = data[2] | data[3] << 8
+
+        elif (op == 0x05):
+
+            # Full or partial readout of the buffer
+            self.response = self.get_frame(min(512 * data[3] // 4, self.buf_len))
+
+        return len(data)
+
+    def read(self, length, timeout):
+
+        if (isinstance(length, array.array)):
+
+            buf = length
+            length = len(buf) * buf.itemsize
+
+        else:
+
+            buf = None
+
+        ret = self.response
+
+        self.response = None
+
+        if (ret is None):
+
+            self.wait(timeout / 1000.)
+
+            raise usb.core.USBTimeoutError('Operation timed out')
+
+        ret = ret[:length]
+
+        self.wait(self.read_latency + len(ret) / self.bulk_rate)
+
+        if (buf is not None):
+
+            memoryview(buf).cast('B')[:len(ret)] = ret
+
+            return len(ret)
+
+        data = array.array('B')
+
+        data.frombytes(ret)
+
+        return data
+
+    def close(self):
+
+        self.armed_at = None
+
+#%% Fake pyusb device
+
+class FakeEndpoint:
+
+    def __init__(self, address, sim):
+
+        self.bEndpointAddress = address
+
+        self.sim = sim
+
+    def write(self, data):
+
+        return self.sim.write(data)
+
+class FakeUsbDevice:
+
+    # pyusb device on top of SimTransport, for UsbTransport without a scope
+
+    bus = 1
+    address = 2
+
+    def __init__(self, sim = None):
+
+        self.sim = SimTransport() if sim is None else sim
+
+        self.endpoints = [FakeEndpoint(0x02, self.sim),
+                          FakeEndpoint(0x86, self.sim)]
+
+    def set_configuration(self):
+
+        pass
+
+    def get_active_configuration(self):
+
+        return {(0, 0): self.endpoints}
+
+    def set_interface_altsetting(self, interface, alternate_setting):
+
+        pass
+
+    def ctrl_transfer(self, rtype, req, wValue, wIndex, data):
+
+        return self.sim.ctrl_transfer(rtype, req, wValue, wIndex, data)
+
+    def read(self, ep, length, timeout):
+
+        if (ep != 0x86):
+
+            raise usb.core.USBError('Wrong endpoint 0x%02X' % ep)
+
+        return self.sim.read(length, timeout)
+
+    def reset(self):
+
+        self.sim.close()
+
+@contextlib.contextmanager
+def fake_pyusb(dev = None):
+
+    # usb.core.find, usb.util.find_descriptor and dispose_resources of the
+    # driver see only the fake device
+    if dev is None:
+
+        dev = FakeUsbDevice()
+
+    def find(find_all = False, custom_match = None, **kwargs):
+
+        devs = [d for d in [dev] if (custom_match is None) or custom_match(d)]
+
+        return devs if find_all else (devs[0] if devs else None)
+
+    def find_descriptor(intf, custom_match = None):
+
+        return next((e for e in intf if custom_match(e)), None)
+
+    saved = (usb.core.find, usb.util.find_descriptor, usb.util.dispose_resources)
+
+    usb.core.find = find
+    usb.util.find_descriptor = find_descriptor
+    usb.util.dispose_resources = lambda d: None
+
+    try:
+
+        yield dev
+
+    finally:
+
+        usb.core.find, usb.util.find_descriptor, usb.util.dispose_resources = saved
+
+#%% Main
+
+if __name__ == "__main__":
+
+    h0 = pyhantek6254BC.Hantek(SimTransport())
+
+    t0 = time.perf_counter()
+
+    for i in range(20):
+
+        Ch1, Ch2, Ch3, Ch4 = h0.GetData()
+
+    dt = time.perf_counter() - t0
+
+    print('GetData: %.1f frames / s' % (20 / dt))
+
+    h0.close()
+
+#%% End
@@ -0,0 +1,263 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import hantek_dsp
+
+#%% Windows and frequency axis
+
+# Cached per length and per (length, samplerate)
+WINDOWS = {}
+FREQS = {}
+
+# Flat top of the HP / Agilent analyzers, accurate amplitudes
+FLATTOP = [0.21557895, -0.41663158, 0.277263158, -0.083578947, 0.006947368]
+
+def get_window(name, n):
+
+    key = (name, n)
+
+    if (key not in WINDOWS):
+
+        if (name == 'hann'):
+
+            w = np.hanning(n)
+
+        elif (name == 'hamming'):
+
+            w = np.hamming(n)
+
+        elif (name == 'blackman'):
+
+            w = np.blackman(n)
+
+        elif (name == 'flattop'):
+
+            x = 2 * np.pi * np.arange(n) / (n - 1)
+
+            w = sum(a * np.cos(k * x) for k, a in enumerate(FLATTOP))
+
+        elif (name == 'rect'):
+
+            w = np.ones(n)
+
+        else:
+
+            raise ValueError('Available windows: hann, hamming, blackman, flattop, rect')
+
+        WINDOWS[key] = w.astype(np.float32)
+
+    return WINDOWS[key]
+
+def get_freqs(n, samplerate):
+
+    key = (n, samplerate)
+
+    if (key not in FREQS):
+
+        FREQS[key] = np.fft.rfftfreq(n, 1. / samplerate)
+
+    return FREQS[key]
+
+#%% Spectrum analyzer
+
+class Spectrum:
+
+    # Power spectra (V rms ** 2 per bin) of all 4 channels of the frames of
+    # pyhantek6254BC.Hantek, one rfft call per frame.
+    # average: 'none' - last frame, 'linear' - mean of the last frames frames,
+    # 'peak' - peak hold, 'welch' - mean of the overlapping segments of every
+    # frame and linear mean over frames.
+
+    AVERAGES = ['none', 'linear', 'peak', 'welch']
+
+    def __init__(self, hantek, window = 'hann', average = 'none', frames = 8,
+                 segment = 1024, overlap = 0.5):
+
+        if (average not in self.AVERAGES):
+
+            raise ValueError('Available averages: %s' % self.AVERAGES)
+
+        self.hantek = hantek
+        self.window = window
+        self.average = average
+        self.frames = frames
+        self.segment = segment
+        self.overlap = overlap
+
+        self.key = None
+
+    def setup(self):
+
+        # Buffers for the current buffer length and samplerate
+        h0 = self.hantek
+
+        key = (h0.buf_len, h0.dictSR_N[h0.TBase])
+
+        if (key == self.key):
+
+            return
+
+        buf_len, samplerate = key
+
+        n = min(self.segment, buf_len) if (self.average == 'welch') else buf_len
+
+        self.n = n
+        self.step = max(int(n * (1. - self.overlap)), 1)
+
+        self.win = get_window(self.window, n)
+        self.freqs = get_freqs(n, samplerate)
+
+        # |X| ** 2 -> V rms ** 2, one-sided
+        self.scale = np.full(len(self.freqs), 2. / np.sum(self.win) ** 2)
+        self.scale[0] = self.scale[0] / 2
+
+        if (n % 2 == 0):
+
+            self.scale[-1] = self.scale[-1] / 2
+
+        self.volts = np.empty((4, buf_len), dtype = np.float32)
+
+        if (self.average == 'welch'):
+
+            segs = sliding_window_view(self.volts, n, axis = -1)[:, ::self.step]
+
+            self.segs = segs
+            self.windowed = np.empty(segs.shape, dtype = np.float32)
+
+        else:
+
+            self.windowed = np.empty((4, n), dtype = np.float32)
+
+        self.power = np.zeros((4, len(self.freqs)))
+        self.ring = np.zeros((self.frames, 4, len(self.freqs)))
+        self.sum = np.zeros((4, len(self.freqs)))
+
+        self.key = key
+
+        self.reset()
+
+    def reset(self):
+
+        if self.key is None:
+
+            return
+
+        self.power.fill(0)
+        self.sum.fill(0)
+
+        self.count = 0
+
+    def frame_power(self, frame):
+
+        h0 = self.hantek
+
+        if isinstance(frame, np.ndarray) and (frame.dtype == np.uint8):
+
+            # Raw codes (4, n), volts with the LUT of the current ChVDiv
+            hantek_dsp.codes_to_volts(frame, h0.GetLUT(np.float32), self.volts)
+
+        else:
+
+            for i in range(4):
+
+                self.volts[i] = frame[i]
+
+        if (self.average == 'welch'):
+
+            np.multiply(self.segs, self.win, out = self.windowed)
+
+            X = np.fft.rfft(self.windowed, axis = -1)
+
+            p = np.mean(X.real ** 2 + X.imag ** 2, axis = 1)
+
+        else:
+
+            np.multiply(self.volts, self.win, out = self.windowed)
+
+            X = np.fft.rfft(self.windowed, axis = -1)
+
+            p = X.real ** 2 + X.imag ** 2
+
+        p *= self.scale
+
+        return p
+
+    def add(self, frame):
+
+        # frame - (4, buf_len) uint8 codes or 4 channels in volts (GetData)
+        self.setup()
+
+        p = self.frame_power(frame)
+
+        if (self.average == 'none'):
+
+            self.power[...] = p
+
+        elif (self.average == 'peak'):
+
+            if (self.count == 0):
+
+                self.power[...] = p
+
+            np.maximum(self.power, p, out = self.power)
+
+        else:
+
+            slot = self.ring[self.count % self.frames]
+
+            if (self.count >= self.frames):
+
+                self.sum -= slot
+
+            self.sum += p
+
+            slot[...] = p
+
+            np.multiply(self.sum, 1. / min(self.count + 1, self.frames),
+                        out = self.power)
+
+        self.count = self.count + 1
+
+        return self.freqs, self.power
+
+    def dbv(self, out = None):
+
+        # dBV of the averaged spectrum (0 dBV - 1 V rms)
+        if out is None:
+
+            out = np.empty(self.power.shape)
+
+        np.maximum(self.power, 1e-20, out = out)
+
+        np.log10(out, out = out)
+
+        out *= 10
+
+        return out
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import time
+    import pyhantek6254BC
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    sp = Spectrum(h0, average = 'welch')
+
+    t0 = time.perf_counter()
+
+    for raw in h0.stream(50, raw = True):
+
+        freqs, power = sp.add(raw.T)
+
+    print('%.1f spectra / s' % (50 / (time.perf_counter() - t0)))
+
+    dbv = sp.dbv()
+
+    print('Noise floor Ch1: %.1f dBV' % np.median(dbv[0]))
+
+    h0.close()
+
+#%% End
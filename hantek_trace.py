@@ -0,0 +1,293 @@
+import json
+import time
+import numpy as np
+
+#%% Trace records
+
+KINDS = ['ctrl', 'write', 'read', 'rst']
+
+TRACE = np.dtype([('seq', '<u8'),
+                  ('kind', 'u1'),
+                  ('opcode', 'u1'), # first byte of the bulk command or ctrl request
+                  ('length', '<u4'),
+                  ('payload', 'S16'), # first bytes of the data
+                  ('start', '<i8'), # perf_counter_ns
+                  ('end', '<i8'),
+                  ('error', '<i4')]) # errno, -1 - other exception
+
+# Bulk commands of pyhantek6254BC
+OPCODES = {0x00: 'position Ch1', # CHsPosCmds
+           0x01: 'position Ch2',
+           0x02: 'position Ch3',
+           0x03: 'start', # StartCollectData
+           0x04: 'position Ch4',
+           0x05: 'data', # ReadData
+           0x06: 'state', # ReadState
+           0x07: 'trig level', # VTriggerLevelCmds
+           0x08: 'adc register', # ADC and relay registers
+           0x0C: 'version', # InitHard
+           0x0D: 'trigger word', # GetTrigger
+           0x0E: 'trigger pos',
+           0x0F: 'timebase', # SampleRateCmds
+           0x10: 'timebase',
+           0x11: 'trig mode', # TrigerModeCmds, slope
+           0x12: 'ram / trig control'} # RamAndTrigerControlCmds, source
+
+REQUESTS = {162: 'eeprom', 178: 'rlen', 179: 'rst', 234: 'init'}
+
+def event_name(kind, opcode):
+
+    if (kind == 0):
+
+        return 'ctrl %s' % REQUESTS.get(opcode, opcode)
+
+    if (kind == 3):
+
+        return 'rst'
+
+    return '%s %s' % (KINDS[kind], OPCODES.get(opcode, '0x%02X' % opcode))
+
+class Tracer:
+
+    # Preallocated ring of the last size records
+
+    def __init__(self, size = 65536):
+
+        self.size = size
+
+        self.ring = np.zeros(size, dtype = TRACE)
+
+        self.seq = 0
+
+    def record(self, kind, opcode, length, payload, start, end, error = 0):
+
+        self.ring[self.seq % self.size] = (self.seq, kind, opcode, length,
+                                           payload, start, end, error)
+
+        self.seq = self.seq + 1
+
+    def clear(self):
+
+        self.seq = 0
+
+    def events(self):
+
+        # Records oldest first
+        n = min(self.seq, self.size)
+
+        idx = (np.arange(self.seq - n, self.seq)) % self.size
+
+        return self.ring[idx]
+
+    def summary(self):
+
+        # count, total and mean time (s) per event name
+        ev = self.events()
+
+        res = {}
+
+        for e in ev:
+
+            name = event_name(int(e['kind']), int(e['opcode']))
+
+            count, total = res.get(name, (0, 0))
+
+            res[name] = (count + 1, total + int(e['end'] - e['start']))
+
+        return {name: {'count': count, 'total': total * 1e-9,
+                       'mean': total * 1e-9 / count}
+                for name, (count, total) in res.items()}
+
+    def to_jsonl(self, path):
+
+        with open(path, 'w') as f:
+
+            for e in self.events():
+
+                length = int(e['length'])
+
+                payload = e['payload'].ljust(min(length, 16), b'\x00')
+
+                f.write(json.dumps({'seq': int(e['seq']),
+                                    'name': event_name(int(e['kind']),
+                                                       int(e['opcode'])),
+                                    'kind': KINDS[e['kind']],
+                                    'opcode': int(e['opcode']),
+                                    'length': length,
+                                    'payload': payload.hex(),
+                                    'start_ns': int(e['start']),
+                                    'end_ns': int(e['end']),
+                                    'error': int(e['error'])}) + '\n')
+
+    def to_chrome(self, path):
+
+        # Chrome trace events (chrome://tracing, Perfetto), times in us,
+        # one row per kind
+        ev = self.events()
+
+        t0 = int(ev['start'].min()) if len(ev) else 0
+
+        events = []
+
+        for e in ev:
+
+            args = {'length': int(e['length']), 'opcode': int(e['opcode'])}
+
+            if e['error']:
+
+                args['error'] = int(e['error'])
+
+            events.append({'name': event_name(int(e['kind']), int(e['opcode'])),
+                           'cat': KINDS[e['kind']],
+                           'ph': 'X',
+                           'ts': (int(e['start']) - t0) / 1e3,
+                           'dur': (int(e['end']) - int(e['start'])) / 1e3,
+                           'pid': 0,
+                           'tid': int(e['kind']),
+                           'args': args})
+
+        with open(path, 'w') as f:
+
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+#%% Tracing transport
+
+class TracingTransport:
+
+    # Wraps the transport of Hantek, every transfer is recorded. Reads are
+    # recorded with the opcode of the last bulk command.
+
+    def __init__(self, transport, tracer):
+
+        self.transport = transport
+        self.tracer = tracer
+
+        self.opcode = 0
+
+    def traced(self, kind, opcode, length, payload, func, *args):
+
+        start = time.perf_counter_ns()
+
+        try:
+
+            ret = func(*args)
+
+        except Exception as e:
+
+            error = getattr(e, 'errno', None)
+
+            self.tracer.record(kind, opcode, length, payload, start,
+                               time.perf_counter_ns(),
+                               -1 if error is None else error)
+
+            raise
+
+        self.tracer.record(kind, opcode, length, payload, start,
+                           time.perf_counter_ns())
+
+        return ret
+
+    def ctrl_transfer(self, rtype, req, wValue, wIndex, data):
+
+        if isinstance(data, int):
+
+            length, payload = data, b''
+
+        else:
+
+            length, payload = len(data), bytes(data[:16])
+
+        return self.traced(0, req, length, payload,
+                           self.transport.ctrl_transfer, rtype, req, wValue,
+                           wIndex, data)
+
+    def write(self, data):
+
+        self.opcode = data[0]
+
+        return self.traced(1, data[0], len(data), bytes(data[:16]),
+                           self.transport.write, data)
+
+    def read(self, length, timeout):
+
+        n = length if isinstance(length, int) else len(length)
+
+        return self.traced(2, self.opcode, n, b'', self.transport.read,
+                           length, timeout)
+
+    def close(self):
+
+        self.transport.close()
+
+    def __getattr__(self, name):
+
+        return getattr(self.transport, name)
+
+#%% Enable / disable
+
+def enable(hantek, tracer = None):
+
+    # Nothing is changed in the driver code paths: the transport is wrapped
+    # and rst() is shadowed on the instance, disable() restores both
+    h0 = hantek
+
+    if isinstance(h0.transport, TracingTransport):
+
+        return h0.transport.tracer
+
+    if tracer is None:
+
+        tracer = Tracer()
+
+    h0.transport = TracingTransport(h0.transport, tracer)
+
+    rst = h0.rst
+
+    def traced_rst():
+
+        return h0.transport.traced(3, 179, 0, b'', rst)
+
+    h0.rst = traced_rst
+
+    return tracer
+
+def disable(hantek):
+
+    h0 = hantek
+
+    if isinstance(h0.transport, TracingTransport):
+
+        h0.transport = h0.transport.transport
+
+        del h0.rst
+
+#%% Main
+
+if __name__ == "__main__":
+
+    import pyhantek6254BC
+    import hantek_sim
+
+    h0 = pyhantek6254BC.Hantek(hantek_sim.SimTransport())
+
+    tracer = enable(h0)
+
+    for frame in h0.stream(10, reuse = True):
+
+        pass
+
+    disable(h0)
+
+    for name, s in sorted(tracer.summary().items(),
+                          key = lambda item: -item[1]['total']):
+
+        print('%-20s %6d %10.3f ms %8.1f us' % (name, s['count'],
+                                              s['total'] * 1e3,
+                                              s['mean'] * 1e6))
+
+    tracer.to_jsonl('trace.jsonl')
+    tracer.to_chrome('trace.json')
+
+    h0.close()
+
+#%% End
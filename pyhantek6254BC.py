@@ -1,18 +1,140 @@
 import usb.core
 import usb.util
+import array
+import contextlib
 import time
 import struct
 import numpy as np
 import pprint
 
+#%% Timebase
+
+# samplerate: (0x0F divider, 0x10 bytes 2 and 8, code1 base and offset,
+#              code2 base and offset), codes are base // bln + offset
+TIMEBASE = {125:         (0x0F423F, 0x1C, 0x00, 0x1e84800, 390625, 0x1e84800, 31250),
+            250:         (0x07A11F, 0x9C, 0x00, 0xf42400, 195312, 0xf42400, 15625),
+            500:         (0x03D08F, 0x5C, 0x80, 0x7a1200, 97656, 0x7a1200, 7812),
+            1_250:       (0x00869F, 0x9C, 0x00, 0x30d400, 39062, 0x30d400, 3125),
+            2_500:       (0x00C34F, 0x5C, 0x80, 0x61a800, 19531, 0x61a800, 1562),
+            5_000:       (0x0061A7, 0xBC, 0x40, 0xC3500, 9765, 0xC35000, 781),
+            12_500:      (0x00270F, 0x5C, 0x80, 0x4E200, 3906, 0x4E200, 312),
+            25_000:      (0x001387, 0x3C, 0x40, 0x27100, 1953, 0x27100, 156),
+            50_000:      (0x0009C3, 0xAC, 0x20, 0x13880, 976, 0x13880, 78),
+            125_000:     (0x0003E7, 0xBC, 0x40, 0x7D00, 390, 0x7D00, 31),
+            250_000:     (0x0001F3, 0x6C, 0xA0, 0x3E80, 195, 0x3E80, 15),
+            500_000:     (0x0000F9, 0xC4, 0xD0, 0x1F40, 97, 0x1F40, 7),
+            1_250_000:   (0x000063, 0x2C, 0x20, 0x0C80, 39, 0x0C80, 3),
+            2_500_000:   (0x000031, 0xA4, 0x90, 0x640, 19, 0x640, 1),
+            5_000_000:   (0x000018, 0xE0, 0xC8, 0x320, 9, 0x320, 0),
+            12_500_000:  (0x000009, 0x04, 0x50, 0x140, 4, 0x140, 0),
+            25_000_000:  (0x000004, 0x10, 0x28, 0xA0, 2, 0xA0, 0),
+            50_000_000:  (0x000001, 0x16, 0x14, 0x50, 1, 0x50, 0),
+            125_000_000: (0x000000, 0x80, 0x08, 0x20, 0, 0x20, 0),
+            250_000_000: (0x000000, 0x4E, 0x04, 0x10, 0, 0x10, 0)}
+
+def timebase_cmds(samplerate, buf_len):
+    
+    div, b2, b8, base1, add1, base2, add2 = TIMEBASE[samplerate]
+    
+    bln = 16384 // buf_len
+    
+    code1 = base1 // bln + add1
+    code2 = base2 // bln + add2
+    
+    cmd_0F = bytes([0x0F, 0x00, div & 0xFF, (div >> 8) & 0xFF,
+                    (div >> 16) & 0xFF, 0x00])
+    
+    cmd_10 = bytes([0x10, 0x00, b2,
+                    code1 & 0xFF, (code1 >> 8) & 0xFF, (code1 >> 16) & 0xFF,
+                    0x00, 0x00, b8,
+                    code2 & 0xFF, (code2 >> 8) & 0xFF, (code2 >> 16) & 0xFF,
+                    0x00, 0x00])
+    
+    return cmd_0F, cmd_10
+
+# (samplerate, buf_len): ready to send 0x0F and 0x10 commands
+TIMEBASE_CMDS = {(sr, bl): timebase_cmds(sr, bl) for sr in TIMEBASE
+                 for bl in [4 * 1024, 8 * 1024, 16 * 1024]}
+
+# Группы команд, которые надо отправить заново после группы-ключа:
+# 0x08 .. 0x2A группы samplerate обнуляет коды делителей каналов (sCh),
+# их снова пишет группа channels, как в Configure
+GROUP_DEPS = {'samplerate': ['channels']}
+
+# Биты состояния 0x06 (dsoHTGetState в SDK Hantek)
+STATE_TRIGGERED = 0x01
+STATE_COMPLETE = 0x02
+
+def volts_lut(chvdiv, dtype = np.float32):
+    
+    # (4, 256) код АЦП -> вольты
+    codes = np.arange(256.)
+    
+    offset = np.array([128., 128., 129., 128.])
+    
+    vdiv = np.array(chvdiv, dtype = float)
+    
+    lut = (codes - offset[:, None]) / 255. * 10. * vdiv[:, None]
+    
+    return lut.astype(dtype)
+
 #%% Class
 
-class Hantek:
+def eeprom_serial(data):
+    
+    # Идентификатор прибора - байты EEPROM 0x1580 в hex
+    return bytes(data).rstrip(b'\x00\xff').hex()
+
+def read_serial(dev):
+    
+    try:
+        
+        return eeprom_serial(dev.ctrl_transfer(0xC0, 162, 0x1580, 0, 71))
+    
+    except usb.core.USBError as e:
+        
+        # Например, прибор занят другим процессом
+        print(e)
+        
+        return None
+
+def find_devices():
+    
+    # Все подключенные 6254BC: шина, адрес и идентификатор
+    devices = []
     
-    def __init__(self):
+    for dev in usb.core.find(find_all = True, idVendor = 0x04b5,
+                             idProduct = 0x6cde):
+        
+        devices.append({'bus': dev.bus, 'address': dev.address,
+                        'serial': read_serial(dev)})
+        
+    return devices
+
+class UsbTransport:
+    
+    def __init__(self, bus = None, address = None, serial = None):
+        
+        # Без аргументов - первый найденный прибор
+        def match(dev):
+            
+            if (bus is not None) and (dev.bus != bus):
+                
+                return False
+            
+            if (address is not None) and (dev.address != address):
+                
+                return False
+            
+            if (serial is not None) and (read_serial(dev) != serial):
+                
+                return False
+            
+            return True
         
         dev = usb.core.find(idVendor = 0x04b5,
-                            idProduct = 0x6cde)
+                            idProduct = 0x6cde,
+                            custom_match = match)
 
         if dev is None:
             
@@ -20,7 +142,8 @@ class Hantek:
         
         else:
             
-            print('Device Hantek 6254BC is connected')
+            print('Device Hantek 6254BC is connected, bus %d, address %d'
+                  % (dev.bus, dev.address))
 
         # set the active configuration. With no arguments, the first
         # configuration will be the active one
@@ -50,6 +173,58 @@ class Hantek:
 
         self.dev = dev
 
+    def ctrl_transfer(self, rtype, req, wValue, wIndex, data):
+        
+        return self.dev.ctrl_transfer(rtype, req, wValue, wIndex, data)
+
+    def write(self, data):
+        
+        return self.ep2.write(data)
+
+    def read(self, length, timeout):
+        
+        return self.dev.read(self.ep6.bEndpointAddress, length, timeout)
+
+    def close(self):
+        
+        try:
+
+            self.dev.reset()
+
+        except usb.core.USBError as e:
+    
+            print(e)
+        
+        usb.util.dispose_resources(self.dev)
+
+class Hantek:
+    
+    def __init__(self, transport = None):
+        
+        # USB by default, hantek_sim.SimTransport() for work without a scope
+        if transport is None:
+            
+            transport = UsbTransport()
+            
+        self.transport = transport
+
+        # Пакетная передача команд, см. batch()
+        self.batch_depth = 0
+        self.batch_rst = False
+
+        # Ожидание данных по состоянию 0x06 или фиксированная пауза как раньше
+        self.poll_state = True
+        self.state_timeout = 0.1 # s, сверх buf_len / samplerate * 1.5
+        self.armed_at = 0.
+        self.trig_word = 0 # байты 1-3 ответа 0x0D последнего кадра
+
+        # Ошибки USB в ctrl: все и ожидаемые (аргумент error), см. hantek_metrics
+        self.usb_errors = 0
+        self.usb_errors_ignored = 0
+
+        # Последние отправленные команды каждой группы, см. apply()
+        self.shadow = {}
+
         # Длина буфера данных каждого канала в АЦП
         self.buf_len = 16 * 1024 # 8 * 1024, 4 * 1024
         self.buf_lens = [4 * 1024, 8 * 1024, 16 * 1024]
@@ -70,6 +245,18 @@ class Hantek:
 
         self.ChVDiv = [1, 1, 1, 1]
 
+        # Тип данных GetData, np.float32 или np.float64
+        self.dtype = np.float32
+        self.dtypes = [np.float32, np.float64]
+        self.lut = None
+        self.lut_key = None
+
+        # Буферы, переиспользуемые от кадра к кадру
+        self.raw_buf = array.array('B')
+        self.out_buf = np.empty((0, 0), dtype = self.dtype)
+        self.state_buf = array.array('B', bytes(512))
+        self.idx_buf = np.empty(0, dtype = np.intp)
+
         # TDiv, время на деление, Ms / s
         self.dictSR_N = {8: 250_000_000, 9: 125_000_000, 10: 50_000_000,
                          11: 25_000_000, 12: 12_500_000, 13: 5_000_000,
@@ -94,7 +281,15 @@ class Hantek:
 
         self.Configure()
     
-    def Configure(self):
+    def Configure(self, fast = False):
+        
+        if fast:
+            
+            with self.batch():
+                
+                self.Configure()
+                
+            return
         
         self.SetSampleRate()
         self.SetCHAndTrigger()
@@ -108,14 +303,18 @@ class Hantek:
         
         try:
 
-            ret = self.dev.ctrl_transfer(rtype, req, wValue, 0, data)
+            ret = self.transport.ctrl_transfer(rtype, req, wValue, 0, data)
 
         except usb.core.USBError as e:
 
             print("got", e.errno, e)
 
+            self.usb_errors += 1
+
             if e.errno == error:
 
+                self.usb_errors_ignored += 1
+
                 return
 
             else:
@@ -126,19 +325,44 @@ class Hantek:
 
     def bwrite(self, data, without_rst = False):
         
-        if not without_rst:
+        if not (without_rst or self.batch_rst):
             
             self.rst()
             
-        self.ep2.write(data)
+            self.batch_rst = self.batch_depth > 0
+            
+        self.transport.write(data)
+        
+        if (self.batch_depth == 0):
+            
+            time.sleep(0.001)
+
+    @contextlib.contextmanager
+    def batch(self):
+        
+        # One reset before the first write and one delay after the last
+        # write of the whole sequence instead of per each bwrite
+        self.batch_depth += 1
         
-        time.sleep(0.001)
+        try:
+            
+            yield self
+            
+        finally:
+            
+            self.batch_depth -= 1
+            
+            if (self.batch_depth == 0):
+                
+                self.batch_rst = False
+                
+                time.sleep(0.001)
 
     def bread(self, length):
         
         timeout = 1000
         
-        return self.dev.read(self.ep6.bEndpointAddress, length, timeout)
+        return self.transport.read(length, timeout)
 
     def rst(self):
         
@@ -172,6 +396,9 @@ class Hantek:
     
         verB = self.ctrl(0xC0, 162, 71, 0, 0x1580)
         ver = bytearray(verB)
+        
+        self.eeprom = bytes(ver)
+        self.serial = eeprom_serial(ver)
         # print(ver)
         
         self.rst()
@@ -194,412 +421,99 @@ class Hantek:
         
         self.bwrite(b"\x08\x00\x00\x3F\x00\x55\x04\x00")
         
-    def SetSampleRate(self):
-        
-        self.bwrite(b"\x08\x00\x00\x10\x08\x3A\x04\x00")
-
-        self.bwrite(b"\x08\x00\x00\x04\x02\x3B\x04\x00")
-
-        self.bwrite(b"\x08\x00\x00\x00\x00\x0F\x04\x00")
-
-        self.bwrite(b"\x08\x00\x00\x04\x02\x31\x04\x00")
+    def send_cmds(self, group, cmds):
         
-        self.bwrite(b"\x08\x00\x00\x00\x00\x2A\x04\x00")
+        cmds = [bytes(cmd) for cmd in cmds]
         
-        if (self.buf_len == 16384):
-            
-            bln = 1
+        for cmd in cmds:
             
-        elif (self.buf_len == 8192):
+            self.bwrite(cmd)
             
-            bln = 2
-            
-        elif (self.buf_len == 4096):
-            
-            bln = 4
-
-        if (self.samplerate == 125):
-
-            self.bwrite(b"\x0F\x00\x3F\x42\x0F\x00")
-            
-            send_list = [0x10, 0x00, 0x1C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x1e84800 // bln + 390625
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x1e84800 // bln + 31250
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 250):
+        self.shadow[group] = cmds
 
-            self.bwrite(b"\x0F\x00\x1F\xA1\x07\x00")
-            
-            send_list = [0x10, 0x00, 0x9C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0xf42400 // bln + 195312
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0xf42400 // bln + 15625
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 500):
-
-            self.bwrite(b"\x0F\x00\x8F\xD0\x03\x00")
-            
-            send_list = [0x10, 0x00, 0x5C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x7a1200 // bln + 97656
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x7a1200 // bln + 7812
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 1_250):
-
-            self.bwrite(b"\x0F\x00\x9F\x86\x00\x00")
-            
-            send_list = [0x10, 0x00, 0x9C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x30d400 // bln + 39062
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x30d400 // bln + 3125
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 2_500):
-
-            self.bwrite(b"\x0F\x00\x4F\xC3\x00\x00")
-            
-            send_list = [0x10, 0x00, 0x5C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x61a800 // bln + 19531
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x61a800 // bln + 1562
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 5_000):
-
-            self.bwrite(b"\x0F\x00\xA7\x61\x00\x00")
-            
-            send_list = [0x10, 0x00, 0xBC, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x40, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0xC3500 // bln + 9765
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0xC35000 // bln + 781
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 12_500):
-
-            self.bwrite(b"\x0F\x00\x0F\x27\x00\x00")
-            
-            send_list = [0x10, 0x00, 0x5C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x80, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x4E200 // bln + 3906
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x4E200 // bln + 312
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 25_000):
-
-            self.bwrite(b"\x0F\x00\x87\x13\x00\x00")
-            
-            send_list = [0x10, 0x00, 0x3C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x40, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x27100 // bln + 1953
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x27100 // bln + 156
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-            
-        if (self.samplerate == 50_000):
-
-            self.bwrite(b"\x0F\x00\xC3\x09\x00\x00") 
-
-            send_list = [0x10, 0x00, 0xAC, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x20, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x13880 // bln + 976
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x13880 // bln + 78
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 125_000):
-
-            self.bwrite(b"\x0F\x00\xE7\x03\x00\x00")
-            
-            send_list = [0x10, 0x00, 0xBC, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x40, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x7D00 // bln + 390
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x7D00 // bln + 31
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-   
-        if (self.samplerate == 250_000):
-
-            self.bwrite(b"\x0F\x00\xF3\x01\x00\x00") 
-   
-            send_list = [0x10, 0x00, 0x6C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0xA0, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x3E80 // bln + 195
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x3E80 // bln + 15
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 500_000):
-
-            self.bwrite(b"\x0F\x00\xF9\x00\x00\x00") 
-
-            send_list = [0x10, 0x00, 0xC4, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0xD0, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x1F40 // bln + 97
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x1F40 // bln + 7
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        if (self.samplerate == 1_250_000):
-
-            self.bwrite(b"\x0F\x00\x63\x00\x00\x00")
-
-            send_list = [0x10, 0x00, 0x2C, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x20, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x0C80 // bln + 39
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x0C80 // bln + 3
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        elif (self.samplerate == 2_500_000):
-
-            self.bwrite(b"\x0F\x00\x31\x00\x00\x00")
-
-            send_list = [0x10, 0x00, 0xA4, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x90, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x640 // bln + 19
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x640 // bln + 1
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        elif (self.samplerate == 5_000_000):
-
-            self.bwrite(b"\x0F\x00\x18\x00\x00\x00")
-
-            send_list = [0x10, 0x00, 0xE0, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0xC8, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x320 // bln + 9
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x320 // bln + 0
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        elif (self.samplerate == 12_500_000):
+    def get_groups(self):
         
-            self.bwrite(b"\x0F\x00\x09\x00\x00\x00")
-
-            send_list = [0x10, 0x00, 0x04, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x50, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x140 // bln + 4
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x140 // bln + 0
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
+        # Группы команд в порядке Configure
+        return [('samplerate', self.SampleRateCmds),
+                ('channels', self.CHAndTriggerCmds),
+                ('ram', self.RamAndTrigerControlCmds),
+                ('position', self.CHsPosCmds),
+                ('trig_level', self.VTriggerLevelCmds),
+                ('trig_mode', self.TrigerModeCmds)]
 
-        elif (self.samplerate == 25_000_000):
+    def apply(self, fast = False):
         
-            self.bwrite(b"\x0F\x00\x04\x00\x00\x00")
-            
-            send_list = [0x10, 0x00, 0x10, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x28, 0x00, 0x00, 0x00, 0x00, 0x00]
+        # Send only the groups changed since the last transmission
+        groups = [(group, [bytes(cmd) for cmd in func()])
+                  for group, func in self.get_groups()]
+        
+        names = set(group for group, cmds in groups
+                    if (self.shadow.get(group) != cmds))
+        
+        for group in list(names):
             
-            code1 = 0xA0 // bln + 2
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
+            names.update(GROUP_DEPS.get(group, []))
+        
+        changed = [(group, cmds) for group, cmds in groups if group in names]
+                
+        with (self.batch() if fast else contextlib.nullcontext()):
             
-            code2 = 0xA0 // bln + 0
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
-
-            self.bwrite(send_list)
-
-        elif (self.samplerate == 50_000_000):
+            for group, cmds in changed:
+                
+                self.send_cmds(group, cmds)
+                
+        return [group for group, cmds in changed]
 
-            self.bwrite(b"\x0F\x00\x01\x00\x00\x00")
+    def SetSampleRate(self):
+        
+        self.send_cmds('samplerate', self.SampleRateCmds())
 
-            send_list = [0x10, 0x00, 0x16, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x14, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x50 // bln + 1
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x50 // bln + 0
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
+    def SetCHAndTrigger(self):
+        
+        self.send_cmds('channels', self.CHAndTriggerCmds())
 
-            self.bwrite(send_list)
+    def SetRamAndTrigerControl(self):
+        
+        self.send_cmds('ram', self.RamAndTrigerControlCmds())
 
-        elif (self.samplerate == 125_000_000):
+    def SetCHsPos(self):
+        
+        self.send_cmds('position', self.CHsPosCmds())
 
-            self.bwrite(b"\x0F\x00\x00\x00\x00\x00")
+    def SetVTriggerLevel(self):
+        
+        self.send_cmds('trig_level', self.VTriggerLevelCmds())
 
-            send_list = [0x10, 0x00, 0x80, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x08, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x20 // bln + 0
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x20 // bln + 0
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
+    def SetTrigerMode(self):
+        
+        self.send_cmds('trig_mode', self.TrigerModeCmds())
 
-            self.bwrite(send_list)
+    def SampleRateCmds(self):
+        
+        cmds = []
 
-        elif (self.samplerate == 250_000_000):
+        cmds.append(b"\x08\x00\x00\x10\x08\x3A\x04\x00")
 
-            self.bwrite(b"\x0F\x00\x00\x00\x00\x00")
+        cmds.append(b"\x08\x00\x00\x04\x02\x3B\x04\x00")
 
-            send_list = [0x10, 0x00, 0x4E, 0x00, 0x00, 0x00, 0x00,
-                         0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0x00]
-            
-            code1 = 0x10 // bln + 0
-            send_list[3] = code1 & 0x0000FF
-            send_list[4] = (code1 & 0x00FF00) >> 8
-            send_list[5] = (code1 & 0xFF0000) >> 16
-            
-            code2 = 0x10 // bln + 0
-            send_list[9] = code2 & 0x0000FF
-            send_list[10] = (code2 & 0x00FF00) >> 8
-            send_list[11] = (code2 & 0xFF0000) >> 16
+        cmds.append(b"\x08\x00\x00\x00\x00\x0F\x04\x00")
 
-            self.bwrite(send_list)
+        cmds.append(b"\x08\x00\x00\x04\x02\x31\x04\x00")
+        
+        cmds.append(b"\x08\x00\x00\x00\x00\x2A\x04\x00")
+        
+        cmd_0F, cmd_10 = TIMEBASE_CMDS[(self.samplerate, self.buf_len)]
+        
+        cmds.append(cmd_0F)
+        
+        cmds.append(cmd_10)
+        
+        return cmds
 
-    def SetCHAndTrigger(self):
+    def CHAndTriggerCmds(self):
         
+        cmds = []
+
         send_list = [0x08, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00]
 
         sCh = ['', '', '', '']
@@ -670,25 +584,29 @@ class Hantek:
                     
                     sCh[i] = '0'
 
-        self.bwrite(send_list)
+        cmds.append(send_list)
         
-        self.bwrite(b"\x08\x00\x06\x06\x06\x06\x01\x01")
+        cmds.append(b"\x08\x00\x06\x06\x06\x06\x01\x01")
 
-        self.bwrite(b"\x08\x00\x00\x10\x08\x3A\x04\x00")
+        cmds.append(b"\x08\x00\x00\x10\x08\x3A\x04\x00")
         
-        self.bwrite(b"\x08\x00\x00\x04\x02\x3B\x04\x00")
+        cmds.append(b"\x08\x00\x00\x04\x02\x3B\x04\x00")
         
-        self.bwrite(b"\x08\x00\x00\x00\x00\x0F\x04\x00")
+        cmds.append(b"\x08\x00\x00\x00\x00\x0F\x04\x00")
         
-        self.bwrite(b"\x08\x00\x00\x04\x02\x31\x04\x00")
+        cmds.append(b"\x08\x00\x00\x04\x02\x31\x04\x00")
 
         send_list2 = [0x08, 0x00, 0x00, int('0x' + sCh[1] + sCh[0], 16),
                       int('0x' + sCh[3] + sCh[2], 16), 0x2A, 0x04, 0x00]
         
-        self.bwrite(send_list2)
+        cmds.append(send_list2)
         
-    def SetRamAndTrigerControl(self):
+        return cmds
+
+    def RamAndTrigerControlCmds(self):
         
+        cmds = []
+
         send_list = [0x12, 0x00, 0x00, 0x00, 0x00, self.trig_source]
         
         if (self.samplerate < 250_000_000):
@@ -701,20 +619,28 @@ class Hantek:
             # self.bwrite(b"\x12\x00\x3C\x00\x01\x00")
             send_list[2] = 0x3C
             
-        self.bwrite(send_list)
+        cmds.append(send_list)
         
-    def SetCHsPos(self):
+        return cmds
+
+    def CHsPosCmds(self):
+        
+        cmds = []
+
+        cmds.append(b"\x00\x00\xC2\x71") # 127 - 4a71, 129 - 3b72
         
-        self.bwrite(b"\x00\x00\xC2\x71") # 127 - 4a71, 129 - 3b72
+        cmds.append(b"\x01\x00\x2C\x71") # 127 - b570, 129 - a471
         
-        self.bwrite(b"\x01\x00\x2C\x71") # 127 - b570, 129 - a471
+        cmds.append(b"\x02\x00\xAD\x72") # 127 - 3672, 129 - 2573
         
-        self.bwrite(b"\x02\x00\xAD\x72") # 127 - 3672, 129 - 2573
+        cmds.append(b"\x04\x00\x39\x72") # 127 - c171, 129 - b172
         
-        self.bwrite(b"\x04\x00\x39\x72") # 127 - c171, 129 - b172
+        return cmds
 
-    def SetVTriggerLevel(self):
+    def VTriggerLevelCmds(self):
         
+        cmds = []
+
         trig_low = 28
         trig_high = 228
         
@@ -735,16 +661,22 @@ class Hantek:
                                  MM, MM, MM, MM, MM, MM, MM, MM]
         
         # self.bwrite(b"\x07\x00\x84\x84\x7C\x7C\x84\x84\x7C\x7C\x84\x84\x7C\x7C\x84\x84\x7C\x7C\x80\x80\x80\x80\x80\x80\x80\x80")
-        self.bwrite(send_list)
+        cmds.append(send_list)
+        
+        return cmds
 
-    def SetTrigerMode(self):
+    def TrigerModeCmds(self):
         
+        cmds = []
+
         send_list = [0x11, 0x00, 0x00, self.trig_slope, 0x00, 0x00]
 
-        self.bwrite(send_list)
+        cmds.append(send_list)
 
         # self.bwrite(b"\x11\x00\x00\x00\x00\x00") # RISE
         # self.bwrite(b"\x11\x00\x00\x01\x00\x00") # FALL
+        
+        return cmds
 
     def StartCollectData(self):
         
@@ -759,20 +691,72 @@ class Hantek:
         elif (self.trig_sweep_mode == 'SINGLE'): 
             
             self.bwrite(b"\x03\x00\x04\x00")
+            
+        self.armed_at = time.perf_counter()
         
-    def GetState(self):
+    def ReadState(self):
         
         self.bwrite(b"\x06\x00")
+        
+        self.bread(self.state_buf)
+        
+        return self.state_buf[0]
+        
+    def GetStateTiming(self):
+        
+        # The buffer can not be filled earlier than buf_len / samplerate
+        # after the start, then the state is polled with growing intervals
+        acq = self.buf_len / self.samplerate
+        
+        t_ready = self.armed_at + acq
+        t_end = t_ready + acq * 0.5 + self.state_timeout
+        
+        max_delay = min(max(acq / 8., 1e-3), 0.05)
+        
+        return t_ready, t_end, max_delay
+        
+    def GetState(self):
+        
+        if not self.poll_state:
+            
+            self.bwrite(b"\x06\x00")
+                
+            read0 = np.array(self.bread(512), dtype = int)
+            
+            time.sleep(self.buf_len / self.samplerate * 1.5 + 0.005)
+            
+            self.bwrite(b"\x06\x00")
+            
+            read1 = np.array(self.bread(512), dtype = int)
             
-        read0 = np.array(self.bread(512), dtype = int)
+            return 0
         
-        time.sleep(self.buf_len / self.samplerate * 1.5 + 0.005)
+        t_ready, t_end, max_delay = self.GetStateTiming()
         
-        self.bwrite(b"\x06\x00")
+        delay = 1e-4
+        
+        dt = t_ready - time.perf_counter()
         
-        read1 = np.array(self.bread(512), dtype = int)
+        if (dt > 0):
+            
+            time.sleep(dt)
         
-        return 0
+        while True:
+            
+            state = self.ReadState()
+            
+            if (state & STATE_COMPLETE):
+                
+                return state
+            
+            if (time.perf_counter() + delay > t_end):
+                
+                # As before, the buffer is read out anyway
+                return state
+            
+            time.sleep(delay)
+            
+            delay = min(2. * delay, max_delay)
 
     def Compute_tg(self, trig23, trig1):
         
@@ -817,73 +801,284 @@ class Hantek:
     
         return j6
     
-    def GetData(self):
-        
-        self.StartCollectData()
-        
-        gs_data = np.array(self.GetState(), dtype = float)
+    def GetTrigger(self):
         
         # Get trigger data
         self.bwrite(b"\x0D\x00")
         
         tg_data = self.bread(512)
         
+        # TODO: trigger code ???
         trig23 = tg_data[2] + tg_data[3] * 256
         trig1 = tg_data[1]
         
+        self.trig_word = trig1 | trig23 << 8
+        
+        # j6 = self.Compute_tg(trig23, trig1)
         j6 = self.Compute_tg(trig23, trig1) + 29
         
         send_list = [0x0E, 0x00, j6 & 0xFF, (j6 >> 8) & 0xFF]
         
+        # print('j6 =', hex(j6), send_list)
+        
         self.bwrite(send_list)
         
+        # self.bwrite(b"\x0E\x00\x00\x00")
+        
+        return tg_data
+
+    def GetRawBuffer(self):
+        
+        # Буфер чтения данных, pyusb читает прямо в array.array
+        n = 4 * self.buf_len
+        
+        if (len(self.raw_buf) != n):
+            
+            self.raw_buf = array.array('B', bytes(n))
+            
+        return self.raw_buf
+
+    def GetOutBuffer(self):
+        
+        if (self.out_buf.shape != (4, self.buf_len)) or \
+           (self.out_buf.dtype != self.dtype):
+            
+            self.out_buf = np.empty((4, self.buf_len), dtype = self.dtype)
+            
+        return self.out_buf
+
+    def ReadData(self, buf = None):
+        
         packets = 4 * self.buf_len // 512
+        # packets = 128
         
         # Get data
         self.bwrite([0x05, 0x00, 0x00, packets])
 
-        Chs = np.array(self.bread(512 * packets), dtype = float).reshape((512 * packets // 4, 4)).T
+        if buf is None:
+            
+            return self.bread(512 * packets)
         
-        Ch1 = (Chs[0] - 128.) / 255. * 10. * self.ChVDiv[0]
-        Ch2 = (Chs[1] - 128.) / 255. * 10. * self.ChVDiv[1]
-        Ch3 = (Chs[2] - 129.) / 255. * 10. * self.ChVDiv[2]
-        Ch4 = (Chs[3] - 128.) / 255. * 10. * self.ChVDiv[3]
+        self.bread(buf)
         
-        return [ Ch1, Ch2, Ch3, Ch4]
+        return buf
 
-    def GetRawData(self):
+    def GetLUT(self, dtype):
+        
+        # Таблица код -> вольты для каждого канала, пересчет при смене ChVDiv
+        key = (tuple(self.ChVDiv), dtype)
+        
+        if (key != self.lut_key):
+            
+            self.lut = volts_lut(self.ChVDiv, dtype)
+            self.lut_key = key
+            
+        return self.lut
+
+    def ConvertData(self, data, out = None):
+        
+        Raw = np.frombuffer(data, dtype = np.uint8).reshape((-1, 4))
+        
+        if out is None:
+            
+            out = np.empty((4, Raw.shape[0]), dtype = self.dtype)
+        
+        lut = self.GetLUT(out.dtype.type)
+        
+        # Индексы для np.take, иначе numpy создает их копию на каждый вызов
+        if (len(self.idx_buf) != Raw.shape[0]):
+            
+            self.idx_buf = np.empty(Raw.shape[0], dtype = np.intp)
+        
+        for i in range(4):
+            
+            np.copyto(self.idx_buf, Raw[:, i])
+            
+            np.take(lut[i], self.idx_buf, out = out[i], mode = 'clip')
+        
+        return [ out[0], out[1], out[2], out[3] ]
+
+    def GetRawFrame(self):
         
+        # Коды АЦП uint8 (buf_len, 4) во внутреннем буфере, без преобразования
         self.StartCollectData()
         
-        gs_data = np.array(self.GetState(), dtype = float)
+        self.GetState()
         
-        # Get trigger data
-        self.bwrite(b"\x0D\x00")
+        self.GetTrigger()
         
-        tg_data = self.bread(512)
+        data = self.ReadData(self.GetRawBuffer())
         
-        # TODO: trigger code ???
-        trig23 = tg_data[2] + tg_data[3] * 256
-        trig1 = tg_data[1]
+        return np.frombuffer(data, dtype = np.uint8).reshape((-1, 4))
+
+    def GetData(self, out = None, reuse = False):
         
-        # j6 = self.Compute_tg(trig23, trig1)
-        j6 = self.Compute_tg(trig23, trig1) + 29
+        # out - массив (4, buf_len) для результата, reuse - писать во
+        # внутренний буфер, который перезаписывается следующим вызовом
+        if reuse:
+            
+            out = self.GetOutBuffer()
         
-        send_list = [0x0E, 0x00, j6 & 0xFF, (j6 >> 8) & 0xFF]
+        self.StartCollectData()
         
-        # print('j6 =', hex(j6), send_list)
+        self.GetState()
         
-        self.bwrite(send_list)
+        self.GetTrigger()
         
-        # self.bwrite(b"\x0E\x00\x00\x00")
+        return self.ConvertData(self.ReadData(self.GetRawBuffer()), out)
 
-        packets = 4 * self.buf_len // 512
-        # packets = 128
+    def stream(self, frames = None, reuse = False, raw = False):
         
-        # Get data
-        self.bwrite([0x05, 0x00, 0x00, packets])
+        # Непрерывный сбор: следующий сбор запускается сразу после чтения
+        # кадра, пока кадр преобразуется и обрабатывается вызывающим кодом.
+        # raw - отдавать коды АЦП uint8 (buf_len, 4) без преобразования
+        n = 0
+        
+        self.StartCollectData()
+        
+        while (frames is None) or (n < frames):
+            
+            self.GetState()
+            
+            self.GetTrigger()
+            
+            data = self.ReadData(self.GetRawBuffer())
+            
+            n = n + 1
+            
+            if (frames is None) or (n < frames):
+                
+                self.StartCollectData()
+            
+            if raw:
+                
+                yield np.frombuffer(data, dtype = np.uint8).reshape((-1, 4))
+                
+                continue
+            
+            yield self.ConvertData(data, self.GetOutBuffer() if reuse else None)
 
-        Chs = np.array(self.bread(512 * packets), dtype = float).reshape((512 * packets // 4, 4)).T
+    def GetSegments(self, segments, out = None):
+        
+        # Сегментированный сбор: segments коротких записей подряд, каждая
+        # по своему триггеру. Следующая запись запускается сразу после
+        # чтения предыдущей, копирование идет во время ее сбора.
+        # Возвращает время первого запуска, (segments, 4, buf_len) uint8,
+        # время запуска каждой записи от первого и слова триггера.
+        shape = (segments, 4, self.buf_len)
+        
+        if out is None:
+            
+            out = np.empty(shape, dtype = np.uint8)
+            
+        elif (out.shape != shape):
+            
+            raise ValueError('Segment buffer must have shape %s' % (shape,))
+        
+        times = np.empty(segments)
+        trig_words = np.empty(segments, dtype = np.uint32)
+        
+        t0 = time.time()
+        
+        self.StartCollectData()
+        
+        start = self.armed_at
+        
+        for i in range(segments):
+            
+            times[i] = self.armed_at - start
+            
+            self.GetState()
+            
+            self.GetTrigger()
+            
+            data = self.ReadData(self.GetRawBuffer())
+            
+            trig_words[i] = self.trig_word
+            
+            if (i + 1 < segments):
+                
+                self.StartCollectData()
+            
+            np.copyto(out[i], np.frombuffer(data, dtype = np.uint8).reshape((-1, 4)).T)
+        
+        return t0, out, times, trig_words
+
+    def roll(self, window = None, sink = None, interval = None):
+        
+        # Режим ROLL для низких частот дискретизации: буфер читается по
+        # мере заполнения, отдаются только новые отсчеты uint8 (4, k).
+        # window - hantek_acq.RollingWindow, sink - файл для записи отсчетов
+        # (uint8, по 4 канала на отсчет). Заполнение буфера считается по
+        # времени от запуска сбора, читается ровно число заполненных
+        # пакетов по 512 байт.
+        if interval is None:
+            
+            interval = max(0.05, 128. / self.samplerate)
+        
+        yt_format, sweep_mode = self.YTFormat, self.trig_sweep_mode
+        
+        # Буфер заполняется без ожидания триггера
+        self.YTFormat, self.trig_sweep_mode = 2, 'AUTO'
+        
+        try:
+            
+            while True:
+                
+                self.StartCollectData()
+                
+                last = 0
+                
+                while (last < self.buf_len):
+                    
+                    time.sleep(interval)
+                    
+                    fill = int((time.perf_counter() - self.armed_at) * self.samplerate)
+                    
+                    packets = min(fill, self.buf_len) // 128
+                    
+                    if (128 * packets <= last):
+                        
+                        continue
+                    
+                    self.bwrite([0x0E, 0x00, 0x00, 0x00])
+                    
+                    self.bwrite([0x05, 0x00, 0x00, packets])
+                    
+                    # Ровно packets пакетов: чтение с запасом ждет короткий
+                    # пакет и уходит в таймаут
+                    data = self.bread(512 * packets)
+                    
+                    new = np.frombuffer(data, dtype = np.uint8).reshape((-1, 4))
+                    new = new[last:128 * packets]
+                    
+                    last = 128 * packets
+                    
+                    if sink is not None:
+                        
+                        sink.write(new.tobytes())
+                    
+                    if window is not None:
+                        
+                        window.append(new.T)
+                    
+                    yield new.T
+            
+        finally:
+            
+            self.YTFormat, self.trig_sweep_mode = yt_format, sweep_mode
+
+    def GetRawData(self):
+        
+        self.StartCollectData()
+        
+        gs_data = np.array(self.GetState(), dtype = float)
+        
+        tg_data = self.GetTrigger()
+
+        data = self.ReadData(self.GetRawBuffer())
+
+        Chs = np.array(data, dtype = float).reshape((len(data) // 4, 4)).T
         
         Ch1 = Chs[0]; Ch2 = Chs[1]; Ch3 = Chs[2]; Ch4 = Chs[3]
         
@@ -934,6 +1129,19 @@ class Hantek:
             
             print('Current sweep mode: ' + self.trig_sweep_mode)
 
+    def set_dtype(self, dtype):
+        
+        if (dtype in self.dtypes):
+            
+            self.dtype = dtype
+            
+            print('Data type is set to:', np.dtype(self.dtype).name)
+            
+        else:
+            
+            print('Available data types:',
+                  [np.dtype(t).name for t in self.dtypes])
+
     def set_chvdiv(self, chvdiv):
         
         for i in range(len(chvdiv)):
@@ -996,15 +1204,9 @@ class Hantek:
 
     def close(self):
         
-        try:
-
-            self.dev.reset()
-
-        except usb.core.USBError as e:
-    
-            print(e)
+        self.transport.close()
         
-        usb.util.dispose_resources(self.dev)
+        self.shadow = {}
         
         print("Connection is closed")
 